@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Compression ratio and CPU cost of each StarsFile codec.
+
+Runs every method in ``starsweb.compression.CODECS`` over the fixture
+files in ``starsweb/tests/files`` and reports the compressed size and the
+per-call compress and decompress times.
+
+    python benchmarks/compression.py [--repeat N] [files...]
+
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from starsweb import compression  # noqa: E402
+
+
+def measure(func, data, repeat):
+    timer = timeit.Timer(lambda: func(data))
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('files', nargs='*', default=sorted(glob.glob(
+        os.path.join(ROOT, 'starsweb', 'tests', 'files', '*'))))
+    args = parser.parse_args()
+
+    methods = sorted(compression.CODECS)
+    row = '{0:<14} {1:>8} {2:<5} {3:>8} {4:>7} {5:>10} {6:>10}'
+    print(row.format('file', 'bytes', 'codec', 'stored', 'ratio',
+                     'comp (us)', 'decomp (us)'))
+
+    totals = dict((method, [0, 0, 0.0, 0.0]) for method in methods)
+    raw_total = 0
+    for filename in args.files:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        raw_total += len(data)
+
+        for method in methods:
+            compress, decompress = compression.CODECS[method]
+            packed = compress(data)
+            assert decompress(packed) == data
+
+            comp = measure(compress, data, args.repeat)
+            decomp = measure(decompress, packed, args.repeat)
+
+            total = totals[method]
+            total[0] += len(packed)
+            total[2] += comp
+            total[3] += decomp
+
+            print(row.format(
+                os.path.basename(filename), len(data), method, len(packed),
+                '{0:.2f}'.format(float(len(data)) / len(packed)),
+                '{0:.1f}'.format(comp * 1e6), '{0:.1f}'.format(decomp * 1e6)))
+
+    print()
+    for method in methods:
+        stored, _, comp, decomp = totals[method]
+        print(row.format(
+            'total', raw_total, method, stored,
+            '{0:.2f}'.format(float(raw_total) / stored),
+            '{0:.1f}'.format(comp * 1e6), '{0:.1f}'.format(decomp * 1e6)))
+
+
+if __name__ == '__main__':
+    main()
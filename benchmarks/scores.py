@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""Row counts and query times of the narrow and wide score tables.
+
+Fills a throwaway test database with the same scores in both ``Score``
+(one row per turn, race and section) and ``RaceScore`` (one row per turn
+and race), then times reading a game's whole score matrix and the
+current turn's scores from each.
+
+    python benchmarks/scores.py [--races N] [--turns N] [--repeat N]
+
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample_project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.test.runner import DiscoverRunner  # noqa: E402
+from six.moves import range  # noqa: E402
+
+from starsweb import models, scores  # noqa: E402
+
+
+def narrow_matrix(game):
+    # score_matrix as it would read the Score table, filling the series
+    # the same way so that only the table layout differs.
+    rows = list(models.Score.objects.filter(turn__game=game).order_by(
+        ).values_list('section', 'turn__year', 'race__plural_name', 'value'))
+    year_min = min(row[1] for row in rows)
+    year_max = max(row[1] for row in rows)
+    matrix = {}
+    for section, year, race, value in rows:
+        token = models.Score.TOKEN_VALUES[section]
+        series = matrix.setdefault(token, {}).get(race)
+        if series is None:
+            series = matrix[token][race] = [None] * (year_max - year_min + 1)
+        series[year - year_min] = value
+    return year_min, year_max, matrix
+
+
+def narrow_current(turn):
+    return dict(turn.scores.filter(section=models.Score.SCORE).values_list(
+        'race__plural_name', 'value'))
+
+
+def wide_current(turn):
+    return dict(turn.race_scores.filter(score__isnull=False).values_list(
+        'race__plural_name', 'score'))
+
+
+def populate(n_races, n_turns):
+    host = User.objects.create_user(username='benchmark')
+    game = models.Game.objects.create(name="Benchmark", slug='benchmark',
+                                      host=host)
+    races = [game.races.create(name='Race {0}'.format(i),
+                               plural_name='Race {0}'.format(i),
+                               slug='race-{0}'.format(i), player_number=i)
+             for i in range(n_races)]
+
+    for year in range(2400, 2400 + n_turns):
+        turn = game.turns.create(year=year)
+        values = dict(((race.pk, token), (year - 2399) * (i + 1) + race.pk)
+                      for race in races
+                      for i, token in enumerate(models.Score.TOKENS))
+        models.Score.objects.bulk_create(
+            models.Score(turn=turn, race=race, section=section,
+                         value=values[(race.pk, token)])
+            for race in races
+            for token, (section, name) in zip(models.Score.TOKENS,
+                                              models.Score.SECTIONS))
+        models.RaceScore.objects.bulk_create(
+            models.RaceScore(turn=turn, race=race, **dict(
+                (token, values[(race.pk, token)])
+                for token in models.Score.TOKENS))
+            for race in races)
+    return game, turn
+
+
+def measure(func, repeat):
+    return min(timeit.Timer(func).repeat(repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--races', type=int, default=16)
+    parser.add_argument('--turns', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        game, turn = populate(args.races, args.turns)
+        assert narrow_matrix(game) == scores.score_matrix(game)
+        assert narrow_current(turn) == wide_current(turn)
+
+        row = '{0:<8} {1:>8} {2:>13} {3:>14}'
+        print(row.format('table', 'rows', 'matrix (ms)', 'current (ms)'))
+        for name, model, matrix, current in (
+                ('narrow', models.Score, narrow_matrix, narrow_current),
+                ('wide', models.RaceScore, scores.score_matrix,
+                 wide_current)):
+            print(row.format(
+                name, model.objects.count(),
+                '{0:.2f}'.format(
+                    measure(lambda: matrix(game), args.repeat) * 1e3),
+                '{0:.2f}'.format(
+                    measure(lambda: current(turn), args.repeat) * 1e3)))
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
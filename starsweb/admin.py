@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 from django.contrib import admin
-from starsweb.models import Game, Race, Ambassador, Turn, Score
+from starsweb.models import (Game, Race, Ambassador, Turn, Score, RaceScore,
+                             GenerationLog)
 
 
 class GameAdmin(admin.ModelAdmin):
@@ -16,8 +17,21 @@ class RaceAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
 
 
+class RaceScoreAdmin(admin.ModelAdmin):
+    list_display = ('turn', 'race', 'rank', 'score')
+    list_select_related = ('turn', 'race')
+
+
+class GenerationLogAdmin(admin.ModelAdmin):
+    list_display = ('game', 'timestamp', 'returncode', 'elapsed', 'cpu_time',
+                    'max_rss', 'timed_out', 'killed', 'orphaned')
+    list_filter = ('timed_out', 'killed', 'orphaned')
+
+
 admin.site.register(Game, GameAdmin)
 admin.site.register(Race, RaceAdmin)
 admin.site.register(Ambassador)
 admin.site.register(Turn)
 admin.site.register(Score)
+admin.site.register(RaceScore, RaceScoreAdmin)
+admin.site.register(GenerationLog, GenerationLogAdmin)
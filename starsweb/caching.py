@@ -0,0 +1,186 @@
+from __future__ import absolute_import
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest, QueryDict
+from django.urls import resolve, reverse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_http_date_safe
+
+
+# Cached pages and fragments carry the version of the game they were
+# built from.  A version is a random token held in the cache; the
+# receivers in signals.py drop it whenever the game changes, and the
+# next reader makes a new one, so everything built from the old version
+# is ignored from then on without having to be found and deleted.
+
+
+def timeout():
+    return getattr(settings, 'STARSWEB_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def game_version_key(slug):
+    return 'starsweb:version:game:{0}'.format(slug)
+
+
+GAME_LIST_VERSION_KEY = 'starsweb:version:games'
+
+
+def invalidate_games(slugs):
+    """Drop the versions of the given games, and of the game list.
+
+    They are dropped again once the current transaction commits, since a
+    reader could meanwhile have cached what it still sees under a new
+    version.
+
+    """
+    keys = [game_version_key(slug) for slug in slugs] + [GAME_LIST_VERSION_KEY]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout())
+        version = cache.get(key)
+    return version
+
+
+def game_version(slug):
+    return get_version(game_version_key(slug))
+
+
+def get_game_data(slug, name, build):
+    """Data about a game built by ``build()``, cached under the game's
+    version.  Nothing is cached while ``build()`` returns None."""
+    key = 'starsweb:data:{0}:{1}:{2}'.format(slug, name, game_version(slug))
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        if data is not None:
+            cache.set(key, data, timeout())
+    return data
+
+
+def _warm_request(path, query):
+    # A GET as an anonymous visitor without cookies would make it.  No
+    # middleware runs, so nothing but the view sees it.
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.GET = QueryDict(mutable=True)
+    request.GET.update(query)
+    request.user = AnonymousUser()
+    return request
+
+
+def warm_game(game):
+    """Build a game's cached fragments and data ahead of its players.
+
+    Renders the game's read views as an anonymous visitor would, which
+    leaves the fragments and data every visitor shares, such as the race
+    table and the score data, in the cache under the game's version.
+    No whole page is stored: cache_anonymous_page keys pages on the
+    visitor's CSRF cookie and won't store one rendered with a token
+    made for no cookie, so each visitor still renders their own first
+    copy, from the warmed pieces.  Downloads are sent straight from
+    storage, and have nothing to warm.
+
+    """
+    for name, kwargs, query in (
+            ('game_detail', {'slug': game.slug}, {}),
+            ('score_graph', {'slug': game.slug}, {}),
+            ('score_data', {'game_slug': game.slug}, {'section': 'score'}),
+            ('game_list', {}, {})):
+        request = _warm_request(reverse(name, kwargs=kwargs), query)
+        match = resolve(request.path_info)
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+
+
+def _page_key(request):
+    # The pages carry a CSRF token for the login form, which is only good
+    # with the client's own CSRF cookie, so they are kept per cookie.
+    key = u'{0}\0{1}'.format(request.get_full_path(),
+                             request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''))
+    return 'starsweb:page:{0}'.format(
+        hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def _cacheable(request):
+    # Pages differ by user, so only anonymous ones are shared.  Flash
+    # messages are used up by rendering, so those pages must be rendered.
+    return (request.method in ('GET', 'HEAD') and
+            not request.user.is_authenticated and
+            not messages.get_messages(request))
+
+
+def _cached(response, request):
+    etag = response.get('ETag')
+    last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+    return get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response)
+
+
+def cache_anonymous_page(version_key):
+    """Cache a view's whole response for anonymous users.
+
+    ``version_key(request, **kwargs)`` names the version the page is
+    built from.  A hit costs a single cache round trip, for the version
+    and the page together.
+
+    """
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable(request):
+                return view(request, *args, **kwargs)
+
+            key, page_key = version_key(request, **kwargs), _page_key(request)
+            found = cache.get_many([key, page_key])
+            version = found.get(key)
+            if version is not None and page_key in found:
+                page_version, response = found[page_key]
+                if page_version == version:
+                    return _cached(response, request)
+
+            # Fetched before rendering, so that a change made while
+            # rendering is not hidden under the new version.
+            version = version or get_version(key)
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200 or response.streaming:
+                return response
+            if hasattr(response, 'render'):
+                response.render()
+            # Not when the page sets cookies, or holds a CSRF token made
+            # for a client that has yet to get the cookie for it.
+            new_token = (request.META.get('CSRF_COOKIE_USED') and
+                         settings.CSRF_COOKIE_NAME not in request.COOKIES)
+            if not response.cookies and not new_token:
+                cache.set(page_key, (version, response), timeout())
+            return response
+        return wrapper
+    return decorator
+
+
+def _game_version_key(request, slug=None, game_slug=None, **kwargs):
+    # A race page has a slug of its own as well as its game's.
+    return game_version_key(game_slug or slug)
+
+
+def _game_list_version_key(request, **kwargs):
+    return GAME_LIST_VERSION_KEY
+
+
+# Decorators for the ``dispatch`` of class-based views.
+cached_game = method_decorator(
+    cache_anonymous_page(_game_version_key), name='dispatch')
+cached_game_list = method_decorator(
+    cache_anonymous_page(_game_list_version_key), name='dispatch')
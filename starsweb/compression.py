@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import lzma
+except ImportError:  # Python 2, unless backports.lzma is installed.
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress),
+}
+# Incremental decompressors, for reading a blob a chunk at a time.
+DECOMPRESSORS = {
+    'zlib': zlib.decompressobj,
+}
+if lzma is not None:
+    CODECS['lzma'] = (lzma.compress, lzma.decompress)
+    DECOMPRESSORS['lzma'] = lzma.LZMADecompressor
+
+# The HTTP content-coding a stored blob can be sent under unchanged.
+# HTTP's "deflate" is the zlib format, not raw deflate.
+CONTENT_ENCODINGS = {
+    'zlib': 'deflate',
+}
+
+
+def get_method():
+    """The compression method for newly stored files, or ''.
+
+    Set ``STARSWEB_COMPRESSION`` to one of the names in ``CODECS``.
+
+    """
+    method = getattr(settings, 'STARSWEB_COMPRESSION', None) or ''
+    if method and method not in CODECS:
+        raise ImproperlyConfigured(
+            "Unknown STARSWEB_COMPRESSION method '{0}'; expected one of"
+            " {1}.".format(method, ', '.join(sorted(CODECS))))
+    return method
+
+
+def compress(data, method):
+    if not method:
+        return data
+    return CODECS[method][0](data)
+
+
+def decompress(data, method):
+    if not method:
+        return data
+    return CODECS[method][1](data)
+
+
+def iter_decompress(chunks, method):
+    """Decompress an iterable of chunks, yielding chunks."""
+    if not method:
+        for chunk in chunks:
+            yield chunk
+        return
+    decompressor = DECOMPRESSORS[method]()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if hasattr(decompressor, 'flush'):
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def accepts(request, method):
+    """Whether the client will take a blob stored with ``method`` as is."""
+    encoding = CONTENT_ENCODINGS.get(method)
+    if encoding is None:
+        return False
+    return accepts_encoding(request, encoding)
+
+
+def accepts_encoding(request, encoding):
+    """Whether the client's Accept-Encoding allows ``encoding``."""
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = coding.strip().split(';')
+        if params[0].strip().lower() != encoding:
+            continue
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+import hashlib
+
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+
+from . import models
+
+
+# Validators for pages that only change when their game does.  Every
+# change that shows on them bumps ``Game.modified`` (see signals.py),
+# so one indexed read decides whether the page needs rendering at all.
+# The pages differ by user, so the ETag includes the user.
+
+
+def _memoised(request, key, lookup):
+    # The ETag and Last-Modified functions both want the same stamp.
+    stamps = request.__dict__.setdefault('_starsweb_stamps', {})
+    if key not in stamps:
+        stamps[key] = lookup()
+    return stamps[key]
+
+
+def game_stamp(request, slug):
+    def lookup():
+        stamps = list(models.Game.objects.filter(slug=slug).values_list(
+            'modified', flat=True))
+        return stamps[0] if stamps else None
+    return _memoised(request, ('game', slug), lookup)
+
+
+def game_list_stamp(request, state=None):
+    def lookup():
+        games = models.Game.objects.all()
+        if state is not None:
+            games = games.filter(state=state)
+        # The count notices deletions, which leave no stamp behind.
+        stamp = games.aggregate(Max('modified'), Count('pk'))
+        if stamp['modified__max'] is not None:
+            return stamp['modified__max'], stamp['pk__count']
+    return _memoised(request, ('games', state), lookup)
+
+
+def make_etag(request, stamp):
+    # Pages showing flash messages must be rendered to use them up.
+    if stamp is None or messages.get_messages(request):
+        return None
+    user = request.user.pk if request.user.is_authenticated else ''
+    key = u'{0}:{1}'.format(stamp, user).encode('utf-8')
+    return hashlib.md5(key).hexdigest()
+
+
+def make_last_modified(request, modified):
+    if modified is None or messages.get_messages(request):
+        return None
+    # Logging in changes the page too.
+    if request.user.is_authenticated and request.user.last_login:
+        return max(modified, request.user.last_login)
+    return modified
+
+
+# Pages under a game are routed with ``game_slug``, and may have a
+# ``slug`` of their own, such as a race page's.
+def game_etag(request, slug=None, game_slug=None, **kwargs):
+    return make_etag(request, game_stamp(request, game_slug or slug))
+
+
+def game_last_modified(request, slug=None, game_slug=None, **kwargs):
+    return make_last_modified(request,
+                              game_stamp(request, game_slug or slug))
+
+
+def game_list_etag(request, state=None, **kwargs):
+    return make_etag(request, game_list_stamp(request, state))
+
+
+def game_list_last_modified(request, state=None, **kwargs):
+    stamp = game_list_stamp(request, state)
+    return make_last_modified(request, stamp and stamp[0])
+
+
+# Decorators for the ``dispatch`` of class-based views.
+conditional_game = method_decorator(
+    [vary_on_cookie, condition(game_etag, game_last_modified)],
+    name='dispatch')
+conditional_game_list = method_decorator(
+    [vary_on_cookie, condition(game_list_etag, game_list_last_modified)],
+    name='dispatch')
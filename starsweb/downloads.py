@@ -0,0 +1,102 @@
+"""Signed, expiring links to stored files.
+
+A link's token carries everything needed to serve its file: the name it
+is stored under, its compression method, the filename to download it as
+and when the link expires.  It is signed with ``django.core.signing``
+under ``SALT``, so ``SignedFileDownload`` -- or anything else holding the
+``SECRET_KEY`` -- can check it and serve the file without a database
+query.
+
+Expiry times fall on whole multiples of ``STARSWEB_DOWNLOAD_LINK_MAX_AGE``
+seconds after the turn the file belongs to was generated, so a file's
+link stays the same for a whole period and lasts at least that long.
+
+"""
+from __future__ import absolute_import
+import calendar
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from . import models
+
+
+SALT = 'starsweb.downloads'
+
+
+def max_age():
+    return getattr(settings, 'STARSWEB_DOWNLOAD_LINK_MAX_AGE',
+                   2 * 24 * 60 * 60)
+
+
+def storage():
+    return models.StarsFile._meta.get_field('file').storage
+
+
+def expiry(since=None, now=None):
+    """The expiry time of a link made at ``now`` for a file from ``since``."""
+    period = max_age()
+    start = calendar.timegm(since.utctimetuple()) if since else 0
+    if now is None:
+        now = time.time()
+    elapsed = max(0, int(now) - start)
+    return start + (elapsed // period + 2) * period
+
+
+def make_token(starsfile, filename, since=None, now=None):
+    return signing.dumps(
+        [starsfile.file.name, starsfile.compression, filename,
+         expiry(since, now)],
+        salt=SALT)
+
+
+def read_token(token, now=None):
+    """Return ``(name, compression, filename)`` for a valid token, or None."""
+    try:
+        name, method, filename, expires = signing.loads(token, salt=SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if now is None:
+        now = time.time()
+    if expires < now:
+        return None
+    return name, method, filename
+
+
+def link(starsfile, filename, since=None):
+    return reverse('signed_download',
+                   kwargs={'token': make_token(starsfile, filename, since)})
+
+
+def race_links(game, race, raceturn=None):
+    """Links to the files an ambassador of ``race`` can download.
+
+    Returns a list of ``(filename, url, signed_url)`` triples, in the
+    same names the download views give the files.  ``url`` is the file's
+    immutable, content-addressed download URL; ``signed_url`` works for
+    whoever holds it, without logging in, until it expires.
+
+    """
+    turn = game.latest_turn
+    since = turn.generated if turn is not None else None
+    prefix = game.slug[:8]
+    number = race.player_number + 1 if race.player_number is not None else None
+
+    files = []
+    racefile = race.official_racefile or race.racefile
+    if racefile is not None:
+        files.append((racefile, '{0}.r1'.format(race.slug)))
+    if game.mapfile_id is not None:
+        files.append((game.mapfile, '{0}.xy'.format(prefix)))
+    if raceturn is not None and number is not None:
+        for attr, ext in (('mfile', 'm'), ('xfile', 'x'), ('hfile', 'h')):
+            starsfile = getattr(raceturn, attr)
+            if starsfile is not None:
+                files.append(
+                    (starsfile, '{0}.{1}{2}'.format(prefix, ext, number)))
+
+    return [(filename, starsfile.get_download_url(filename),
+             link(starsfile, filename, since))
+            for starsfile, filename in files]
@@ -171,8 +171,7 @@ class RaceFileForm(forms.ModelForm):
 
         valid = True
         try:
-            self.stars_file = base.StarsFile()
-            self.stars_file.bytes = f.read()
+            self.stars_file = models.StarsFile.parse(f.read())
             if self.stars_file.type != 'r':
                 valid = False
             elif self.stars_file.counts != {8: 1, 6: 1, 0: 1}:
@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F
+
+from starsweb import models, processing
+
+
+def managed_games():
+    # Games with a turngeneration generator follow its rules, pauses and
+    # schedule, and are generated by its auto_generate.
+    if not apps.is_installed('turngeneration'):
+        return []
+    Generator = apps.get_model('turngeneration', 'Generator')
+    return Generator.objects.filter(
+        content_type=ContentType.objects.get_for_model(models.Game)
+    ).values_list('object_id', flat=True)
+
+
+def due_games():
+    """Active games, not left to turngeneration, in which every player
+    has submitted orders.
+
+    The players are the races the turngeneration plugin counts as its
+    agents: human races with a player number and an active ambassador.
+
+    """
+    players = dict(
+        models.Race.objects.filter(
+            game__state='A', game__latest_turn__isnull=False,
+            player_number__isnull=False, is_ai=False,
+            ambassadors__active=True,
+        ).values_list('game').annotate(Count('pk', distinct=True)).order_by()
+    )
+    submitted = dict(
+        models.RaceTurn.objects.filter(
+            turn=F('race__game__latest_turn'), xfile__isnull=False,
+            race__game__state='A', race__player_number__isnull=False,
+            race__is_ai=False, race__ambassadors__active=True,
+        ).values_list('race__game').annotate(
+            Count('pk', distinct=True)).order_by()
+    )
+    return models.Game.objects.filter(
+        pk__in=[pk for pk, count in players.items()
+                if submitted.get(pk) == count]
+    ).exclude(pk__in=list(managed_games())).order_by('pk')
+
+
+class Command(BaseCommand):
+    help = ("Generate the next turn of every game whose orders are all in,"
+            " or of the named games, several at a time.  Games with a"
+            " turngeneration generator are left to it unless named.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', metavar='slug',
+                            help="Generate these games instead.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Games to generate at once; defaults to"
+                            " STARSWEB_GENERATION_WORKERS.")
+
+    def handle(self, *args, **options):
+        if options['slugs']:
+            games = models.Game.objects.filter(
+                slug__in=options['slugs']).order_by('pk')
+        else:
+            games = due_games()
+
+        results = processing.generate_games(games, workers=options['workers'])
+
+        failed = [result for result in results if result.error is not None]
+        for result in results:
+            if result.error is not None:
+                self.stderr.write("Generating {0} failed: {1}".format(
+                    result.game.slug, result.error))
+            elif options['verbosity'] >= 2:
+                self.stdout.write("Generated {0}.".format(result.game.slug))
+
+        if failed:
+            raise CommandError("{0} of {1} games failed to generate.".format(
+                len(failed), len(results)))
@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from starsweb import models, scores
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the precomputed score artefacts of games that have"
+            " generated a turn.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', metavar='slug',
+                            help="Only rebuild these games.")
+
+    def handle(self, *args, **options):
+        games = models.Game.objects.filter(
+            latest_turn__isnull=False).select_related('latest_turn')
+        if options['slugs']:
+            games = games.filter(slug__in=options['slugs'])
+
+        for game in games.order_by('pk'):
+            scores.write_artefact(game, game.latest_turn.year)
+            if options['verbosity'] >= 2:
+                self.stdout.write("Rebuilt {0} ({1}).".format(
+                    game.slug, game.latest_turn.year))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 08:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('commandline', models.TextField()),
+                ('returncode', models.IntegerField(null=True)),
+                ('stdout', models.TextField(blank=True)),
+                ('stderr', models.TextField(blank=True)),
+                ('elapsed', models.FloatField()),
+                ('cpu_time', models.FloatField()),
+                ('max_rss', models.IntegerField(help_text='Peak resident set size, in KiB.')),
+                ('timed_out', models.BooleanField(default=False)),
+                ('killed', models.BooleanField(default=False)),
+                ('orphaned', models.BooleanField(default=False)),
+                ('startup_saved', models.FloatField(null=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_logs', to='starsweb.Game')),
+            ],
+            options={
+                'ordering': ('-timestamp',),
+                'get_latest_by': 'timestamp',
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 09:40
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+import starsweb.models
+
+
+# The type directories used by starsfile_path.
+TYPE_NAMES = {'r': 'race', 'xy': 'map', 'm': 'state', 'x': 'orders',
+              'h': 'history', 'hst': 'host'}
+
+
+def fill_digests(apps, schema_editor):
+    # Move each existing blob to the content-addressed name that a new
+    # upload of the same content would get, so that the two share it.
+    # Old blobs are only deleted once no row still points at them.
+    StarsFile = apps.get_model('starsweb', 'StarsFile')
+    old_names = set()
+    for starsfile in StarsFile.objects.filter(digest='').iterator():
+        if not starsfile.file:
+            continue
+        try:
+            starsfile.file.open('rb')
+            data = starsfile.file.read()
+        except (IOError, OSError):
+            continue
+        finally:
+            starsfile.file.close()
+
+        digest = hashlib.sha256(data).hexdigest()
+        name = '{type}/{shard}/{subshard}/{digest}'.format(
+            type=TYPE_NAMES[starsfile.type], shard=digest[:2],
+            subshard=digest[2:4], digest=digest)
+
+        storage = starsfile.file.storage
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(data))
+        if starsfile.file.name != name:
+            old_names.add(starsfile.file.name)
+
+        StarsFile.objects.filter(pk=starsfile.pk).update(digest=digest,
+                                                         file=name)
+
+    storage = StarsFile._meta.get_field('file').storage
+    in_use = set(StarsFile.objects.filter(
+        file__in=old_names).values_list('file', flat=True))
+    for old_name in old_names - in_use:
+        storage.delete(old_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0002_generationlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='starsfile',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='starsfile',
+            name='file',
+            field=starsweb.models.StarsFileField(upload_to=starsweb.models.starsfile_path),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+    ]
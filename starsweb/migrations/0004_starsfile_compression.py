@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0003_starsfile_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='starsfile',
+            name='compression',
+            field=models.CharField(blank=True, max_length=8),
+        ),
+    ]
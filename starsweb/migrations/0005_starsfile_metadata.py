@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 10:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from starsweb import compression, parsing
+
+
+def fill_metadata(apps, schema_editor):
+    StarsFile = apps.get_model('starsweb', 'StarsFile')
+    for starsfile in StarsFile.objects.filter(game_uid__isnull=True).iterator():
+        if not starsfile.file:
+            continue
+        try:
+            starsfile.file.open('rb')
+            data = starsfile.file.read()
+        except (IOError, OSError):
+            continue
+        finally:
+            starsfile.file.close()
+
+        meta = parsing.file_metadata(
+            compression.decompress(data, starsfile.compression))
+        for field, value in meta.items():
+            setattr(starsfile, field, value)
+        starsfile.save(update_fields=list(meta))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0004_starsfile_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='starsfile',
+            name='block_counts',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='starsfile',
+            name='game_uid',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='starsfile',
+            name='player_number',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='starsfile',
+            name='plural_race_name',
+            field=models.CharField(blank=True, max_length=15),
+        ),
+        migrations.AddField(
+            model_name='starsfile',
+            name='race_name',
+            field=models.CharField(blank=True, db_index=True, max_length=15),
+        ),
+        migrations.AddField(
+            model_name='starsfile',
+            name='year',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='starsfile',
+            index_together=set([('game_uid', 'year', 'player_number')]),
+        ),
+        migrations.RunPython(fill_metadata, migrations.RunPython.noop),
+    ]
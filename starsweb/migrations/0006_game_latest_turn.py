@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_latest_turn(apps, schema_editor):
+    Game = apps.get_model('starsweb', 'Game')
+    Turn = apps.get_model('starsweb', 'Turn')
+    for game in Game.objects.all().iterator():
+        turn = Turn.objects.filter(game=game).order_by('-generated').first()
+        if turn is not None:
+            Game.objects.filter(pk=game.pk).update(latest_turn=turn)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0005_starsfile_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='latest_turn',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='starsweb.Turn'),
+        ),
+        migrations.RunPython(fill_latest_turn, migrations.RunPython.noop),
+    ]
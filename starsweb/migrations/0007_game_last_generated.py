@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 11:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_last_generated(apps, schema_editor):
+    Game = apps.get_model('starsweb', 'Game')
+    for game in Game.objects.filter(latest_turn__isnull=False).select_related('latest_turn').iterator():
+        Game.objects.filter(pk=game.pk).update(
+            last_generated=game.latest_turn.generated)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0006_game_latest_turn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='last_generated',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='game',
+            index_together=set([('last_generated', 'created', 'id'), ('state', 'last_generated', 'created', 'id')]),
+        ),
+        migrations.RunPython(fill_last_generated, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 12:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+TOKENS = ('rank', 'score', 'resources', 'techlevels', 'capships',
+          'escortships', 'unarmedships', 'starbases', 'planets')
+
+
+def copy_scores(apps, schema_editor):
+    Score = apps.get_model('starsweb', 'Score')
+    RaceScore = apps.get_model('starsweb', 'RaceScore')
+
+    batch, current = [], None
+    rows = Score.objects.order_by('turn_id', 'race_id').values_list(
+        'turn_id', 'race_id', 'section', 'value')
+    for turn_id, race_id, section, value in rows.iterator():
+        if (turn_id, race_id) != current:
+            current = (turn_id, race_id)
+            batch.append(RaceScore(turn_id=turn_id, race_id=race_id))
+            if len(batch) > 500:
+                RaceScore.objects.bulk_create(batch[:-1])
+                batch = batch[-1:]
+        setattr(batch[-1], TOKENS[section], value)
+    RaceScore.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0007_game_last_generated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RaceScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField(blank=True, null=True)),
+                ('score', models.IntegerField(blank=True, null=True)),
+                ('resources', models.IntegerField(blank=True, null=True)),
+                ('techlevels', models.IntegerField(blank=True, null=True)),
+                ('capships', models.IntegerField(blank=True, null=True)),
+                ('escortships', models.IntegerField(blank=True, null=True)),
+                ('unarmedships', models.IntegerField(blank=True, null=True)),
+                ('starbases', models.IntegerField(blank=True, null=True)),
+                ('planets', models.IntegerField(blank=True, null=True)),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='race_scores', to='starsweb.Race')),
+                ('turn', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='race_scores', to='starsweb.Turn')),
+            ],
+            options={
+                'ordering': ('-turn', 'race'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='racescore',
+            unique_together=set([('turn', 'race')]),
+        ),
+        migrations.RunPython(copy_scores, migrations.RunPython.noop),
+    ]
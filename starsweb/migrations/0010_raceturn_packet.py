@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('starsweb', '0009_game_modified'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='starsfile',
+            name='type',
+            field=models.CharField(choices=[('r', 'race'), ('xy', 'map'), ('m', 'state'), ('x', 'orders'), ('h', 'history'), ('hst', 'host'), ('zip', 'packet')], max_length=3),
+        ),
+        migrations.AddField(
+            model_name='raceturn',
+            name='packet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='packetraceturn', to='starsweb.StarsFile'),
+        ),
+    ]
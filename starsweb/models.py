@@ -1,35 +1,97 @@
 from __future__ import absolute_import
 import glob
+import hashlib
+import json
 import logging
 import os.path
 import shutil
 import tempfile
-import uuid
+import time
 
+from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.validators import MinValueValidator, MaxValueValidator, validate_comma_separated_integer_list
-from django.db import models
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile
 from django.template.defaultfilters import slugify
 from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 import six
 from six.moves import zip
 
-from starslib import base
-
-from . import markup, processing
+from . import compression, markup, parsing, processing, zipstream
 
 logger = logging.getLogger(__name__)
 
 
 def starsfile_path(instance, filename):
-    return '{type}/{year}/{month}/{day}/{uuid}'.format(
+    # Blobs are addressed by their content, sharded on the leading
+    # digits of the digest.  Compressed blobs get the method as a suffix.
+    path = '{type}/{shard}/{subshard}/{digest}'.format(
         type=instance.get_type_display(),
-        year=instance.timestamp.year,
-        month=instance.timestamp.month,
-        day=instance.timestamp.day,
-        uuid=uuid.uuid4()
+        shard=instance.digest[:2],
+        subshard=instance.digest[2:4],
+        digest=instance.digest
     )
+    if instance.compression:
+        path = '{0}.{1}'.format(path, instance.compression)
+    return path
+
+
+def bulk_update(objs, fields):
+    # QuerySet.bulk_update only arrived in Django 2.2.
+    if not objs:
+        return
+    manager = type(objs[0])._default_manager
+    if hasattr(manager, 'bulk_update'):
+        manager.bulk_update(objs, fields)
+    else:
+        for obj in objs:
+            obj.save(update_fields=fields)
+
+
+class StarsFieldFile(FieldFile):
+    """A stored file that is named after the hash of its contents.
+
+    Storing bytes that are already on disk just points at the existing
+    blob, so a blob may be shared by several StarsFile rows.  The file's
+    header-level metadata is copied onto the row at the same time.  New blobs
+    are compressed with the ``STARSWEB_COMPRESSION`` method, if any, unless
+    that fails to make them smaller; the digest is always that of the
+    uncompressed content.
+
+    """
+
+    def save(self, name, content, save=True):
+        data = b''.join(content.chunks())
+        self.instance.digest = hashlib.sha256(data).hexdigest()
+        for field, value in parsing.file_metadata(data).items():
+            setattr(self.instance, field, value)
+
+        # Most block data is encrypted, so small files often come out
+        # larger than they went in.
+        method = compression.get_method()
+        packed = compression.compress(data, method)
+        if len(packed) >= len(data):
+            method, packed = '', data
+        self.instance.compression = method
+
+        name = self.field.generate_filename(self.instance, name)
+        if not self.storage.exists(name):
+            name = self.storage.save(name, ContentFile(packed),
+                                     max_length=self.field.max_length)
+
+        self.name = name
+        setattr(self.instance, self.field.name, self.name)
+        self._committed = True
+
+        if save:
+            self.instance.save()
+    save.alters_data = True
+
+
+class StarsFileField(models.FileField):
+    attr_class = StarsFieldFile
 
 
 class StarsFile(models.Model):
@@ -38,39 +100,127 @@ class StarsFile(models.Model):
                    ('m', 'state'),
                    ('x', 'orders'),
                    ('h', 'history'),
-                   ('hst', 'host'))
+                   ('hst', 'host'),
+                   ('zip', 'packet'))
 
     upload_user = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True,
                                     related_name='starsweb_files')
     timestamp = models.DateTimeField(auto_now_add=True)
     type = models.CharField(max_length=3, choices=STARS_TYPES)
-    file = models.FileField(upload_to=starsfile_path)
+    file = StarsFileField(upload_to=starsfile_path)
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+    compression = models.CharField(max_length=8, blank=True)
+
+    # Read from the file as it is stored; see parsing.file_metadata.
+    game_uid = models.BigIntegerField(null=True, blank=True)
+    year = models.PositiveSmallIntegerField(null=True, blank=True)
+    player_number = models.PositiveSmallIntegerField(null=True, blank=True)
+    block_counts = models.TextField(blank=True)
+    race_name = models.CharField(max_length=15, blank=True, db_index=True)
+    plural_race_name = models.CharField(max_length=15, blank=True)
+
+    class Meta:
+        index_together = [('game_uid', 'year', 'player_number')]
+
+    def save(self, *args, **kwargs):
+        # Store any new content first, so that its digest is known
+        # before the row is written.
+        if self.file and not self.file._committed:
+            self.file.save(self.file.name, self.file.file, save=False)
+        super(StarsFile, self).save(*args, **kwargs)
+
+    def get_download_url(self, filename):
+        return reverse('starsfile_download',
+                       kwargs={'digest': self.digest, 'filename': filename})
+
+    def read(self):
+        """Return the file's contents, decompressed."""
+        self.file.open('rb')
+        try:
+            data = self.file.read()
+        finally:
+            self.file.close()
+        return compression.decompress(data, self.compression)
+
+    def chunks(self, chunk_size=None):
+        """Yield the file's contents, decompressed, a chunk at a time."""
+        self.file.open('rb')
+        try:
+            for chunk in compression.iter_decompress(
+                    self.file.chunks(chunk_size), self.compression):
+                yield chunk
+        finally:
+            self.file.close()
+
+    @property
+    def counts(self):
+        """The number of blocks of each type, from a scan of the file.
+
+        These match starslib's counts, except that an xy file's only go
+        as far as its planets block; see ``parsing.file_metadata``.
+
+        """
+        if not self.block_counts:
+            return None
+        return dict((int(k), v)
+                    for k, v in json.loads(self.block_counts).items())
+
+    def race_names(self):
+        """Return a race file's name and plural name.
+
+        They are normally read when the file is stored, but files stored
+        before that, or whose race block couldn't be read then, are
+        parsed for them instead.
+
+        """
+        if self.race_name:
+            return self.race_name, self.plural_race_name
+        race_struct = self.parsed().structs[1]
+        return race_struct.race_name, race_struct.plural_race_name
+
+    def parsed(self):
+        """Return the parsed file, shared through the parse cache.
+
+        The result is read-only; see ``parsing.writable``.
+
+        """
+        if not self.digest:
+            return parsing.parse_cache().parse(self.read())
+        return parsing.parse_cache().get(self.digest, self.read)
 
     @classmethod
-    def from_data(cls, data, type=None, **kwargs):
-        sfile = cls.parse(data, type)
+    def from_data(cls, data, type=None, lazy=False, **kwargs):
+        sfile = cls.parse(data, type, lazy)
 
-        starsfile = StarsFile.objects.create(type=sfile.type, **kwargs)
-        starsfile.file.save(sfile.type, ContentFile(data))
+        starsfile = StarsFile(type=sfile.type, **kwargs)
+        starsfile.file.save(sfile.type, ContentFile(data), save=False)
+        starsfile.save()
         starsfile._sfile = sfile
         starsfile._data = data
 
         return starsfile
 
     @classmethod
-    def from_file(cls, _file, type=None, **kwargs):
-        try:  # FIXME
-            _file.open('rb')
-            data = _file.read()
-        finally:
-            _file.close()
+    def from_file(cls, _file, type=None, lazy=False, **kwargs):
+        if isinstance(_file, StarsFieldFile):
+            data = _file.instance.read()
+        else:
+            try:  # FIXME
+                _file.open('rb')
+                data = _file.read()
+            finally:
+                _file.close()
 
-        return cls.from_data(data, type, **kwargs)
+        return cls.from_data(data, type, lazy, **kwargs)
 
     @staticmethod
-    def parse(data, type=None):
-        sfile = base.StarsFile()
-        sfile.bytes = data
+    def parse(data, type=None, lazy=False):
+        # A lazy parse only decodes blocks as they are asked for.  A full
+        # parse is shared through the parse cache, so comes back read-only.
+        if lazy:
+            sfile = parsing.LazyStarsFile(data)
+        else:
+            sfile = parsing.parse_cache().parse(data)
 
         if type is not None and sfile.type != type:
             raise ValueError("Expected StarsFile type {0},"
@@ -101,6 +251,19 @@ class Game(models.Model):
     published = models.BooleanField(default=True)
 
     mapfile = models.ForeignKey(StarsFile, on_delete=models.SET_NULL, null=True)
+    # Denormalised pointer to the most recent turn, kept up to date by
+    # Turn.save, so that listing games needs no per-game turn queries.
+    latest_turn = models.ForeignKey('Turn', on_delete=models.SET_NULL, null=True,
+                                    blank=True, editable=False, related_name='+')
+    last_generated = models.DateTimeField(null=True, blank=True, editable=False)
+    # Bumped by anything that changes the game's public pages: saving the
+    # game, a new turn, and the receivers in signals.py.
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        # Support keyset pagination of the game list; see GameListView.
+        index_together = [('last_generated', 'created', 'id'),
+                          ('state', 'last_generated', 'created', 'id')]
 
     def __str__(self):
         return self.name
@@ -115,8 +278,8 @@ class Game(models.Model):
 
     @property
     def current_turn(self):
-        if self.turns.exists():
-            return self.turns.latest()
+        if self.latest_turn_id is not None:
+            return self.latest_turn
 
     def _tempdir_create(self):
         # Create a temporary directory for Stars to work in.
@@ -136,109 +299,130 @@ class Game(models.Model):
     def generate(self):
         path, winpath = self._tempdir_create()
 
-        if self.state == 'S':
-            self._activate(path, winpath)
-        elif self.state in ('A', 'P'):
-            self._generate(path, winpath)
-        else:
-            logger.error(
-                "Game generation attempted on inactive game '{game.name}'"
-                " (pk={game.pk}, state={game.state}).".format(game=self)
-            )
+        try:
+            # The game's row is locked for the whole generation, so that
+            # two generators -- generate_turns and turngeneration, say --
+            # can't both generate it.  Whichever waited finds the turn
+            # already moved on, and leaves it.
+            with transaction.atomic():
+                locked = Game.objects.select_for_update().only(
+                    'state', 'latest_turn').get(pk=self.pk)
+                if (locked.state, locked.latest_turn_id) != (
+                        self.state, self.latest_turn_id):
+                    logger.info(
+                        "Game '{game.name}' (pk={game.pk}) was generated"
+                        " elsewhere meanwhile; skipped.".format(game=self))
+                elif self.state == 'S':
+                    self._activate(path, winpath)
+                elif self.state in ('A', 'P'):
+                    self._generate(path, winpath)
+                else:
+                    logger.error(
+                        "Game generation attempted on inactive game"
+                        " '{game.name}' (pk={game.pk}, state={game.state})."
+                        .format(game=self)
+                    )
+        except processing.ProcessingError as e:
+            # After the rollback, so that the record is kept.
+            self._record_run(e.result)
+            raise
+        finally:
+            self._tempdir_remove(path)
 
-        self._tempdir_remove(path)
+    def _record_run(self, result):
+        # Keep a record of the Stars! invocation, so that slow games and
+        # leaked wine processes can be tracked down.
+        if result is None:
+            return
+        return self.generation_logs.create(**result._asdict())
 
     def _activate(self, path, winpath):
-        # Move the game into active state.
-        self.state = 'A'
-        self.save()
-
-        # Process the race files for each race.
-        i = 0
-        for race in self.races.all():
-            # If the player hasn't uploaded, mark them as inactive by
-            # giving them a null player number.
-            if race.racefile is None:
-                race.player_number = None
-                race.save()
-                continue
+        with transaction.atomic():
+            # Move the game into active state.
+            self.state = 'A'
+            self.save()
+
+            # Process the race files for each race.
+            players, inactive = [], []
+            for race in self.races.select_related('racefile'):
+                # If the player hasn't uploaded, mark them as inactive by
+                # giving them a null player number.
+                if race.racefile is None:
+                    inactive.append(race.pk)
+                    continue
 
-            race.player_number = i
-            i += 1
+                race.player_number = len(players)
+                players.append(race)
 
-            # Make a copy of their most recent uploaded file as the
-            # official copy.
-            new_starsfile = StarsFile.from_file(
-                race.racefile.file, upload_user=race.racefile.upload_user)
-            race.official_racefile = new_starsfile
+                # Make a copy of their most recent uploaded file as the
+                # official copy.
+                new_starsfile = StarsFile.from_file(
+                    race.racefile.file,
+                    upload_user_id=race.racefile.upload_user_id)
+                race.official_racefile = new_starsfile
 
-            # Write out the race file to the temp directory.
-            filename = 'race.r{0}'.format(race.player_number + 1)
-            with open(os.path.join(path, filename), 'wb') as f:
-                f.write(new_starsfile._data)
+                # Write out the race file to the temp directory.
+                filename = 'race.r{0}'.format(race.player_number + 1)
+                with open(os.path.join(path, filename), 'wb') as f:
+                    f.write(new_starsfile._data)
 
-            race.save()
+            self.races.filter(pk__in=inactive).update(player_number=None)
+            bulk_update(players, ['player_number', 'official_racefile'])
 
-        # Render the game options and write to a .def file.
-        opts = self.options.render(winpath)
-        self.options.file_contents = opts
-        self.options.save()
-        with open(os.path.join(path, 'game.def'), 'w') as f:
-            f.write(opts)
+            # Render the game options and write to a .def file.
+            opts = self.options.render(winpath)
+            self.options.file_contents = opts
+            self.options.save()
+            with open(os.path.join(path, 'game.def'), 'w') as f:
+                f.write(opts)
 
         # Call out to Stars to create the new game files.
         logger.info("Generating start files for '{game.name}'"
                     " (pk={game.pk}).".format(game=self))
 
-        processing.activate(winpath)
+        self._record_run(processing.activate(winpath))
 
-        host = self._process_host(path)
-        self._process_activation(path, host)
+        with transaction.atomic():
+            host = self._process_host(path)
+            self._process_activation(path, host)
 
     def _generate(self, path, winpath):
         current = self.current_turn
 
         # Write out the host file to the temp directory.
-        try:  # FIXME
-            current.hstfile.file.open('rb')
-            hst = current.hstfile.file.read()
-        finally:
-            current.hstfile.file.close()
-
         with open(os.path.join(path, 'game.hst'), 'wb') as f:
-            f.write(hst)
+            f.write(current.hstfile.read())
 
         # Write out the map file.
-        try:  # FIXME
-            self.mapfile.file.open('rb')
-            xyfile = self.mapfile.file.read()
-        finally:
-            self.mapfile.file.close()
-
         with open(os.path.join(path, 'game.xy'), 'wb') as f:
-            f.write(xyfile)
+            f.write(self.mapfile.read())
 
         # Process the x files for every race playing.
-        for raceturn in current.raceturns.all():
-            if raceturn.xfile:
-                # Save off the most recent x file as the official one.
-                raceturn.xfile_official = StarsFile.from_file(
-                    raceturn.xfile.file,
-                    upload_user=raceturn.xfile.upload_user
-                )
-                raceturn.save()
+        with transaction.atomic():
+            submitted = []
+            for raceturn in current.raceturns.select_related('race', 'xfile'):
+                if raceturn.xfile:
+                    # Save off the most recent x file as the official one.
+                    raceturn.xfile_official = StarsFile.from_file(
+                        raceturn.xfile.file,
+                        upload_user_id=raceturn.xfile.upload_user_id
+                    )
+                    submitted.append(raceturn)
 
-                # Write out the x file to the temp directory.
-                target = os.path.join(
-                    path, 'game.x{0}'.format(raceturn.race.player_number + 1))
-                with open(target, 'wb') as f:
-                    f.write(raceturn.xfile_official._data)
+                    # Write out the x file to the temp directory.
+                    target = os.path.join(
+                        path, 'game.x{0}'.format(raceturn.race.player_number + 1))
+                    with open(target, 'wb') as f:
+                        f.write(raceturn.xfile_official._data)
+
+            bulk_update(submitted, ['xfile_official'])
 
         # Call out to Stars to generate the new turn files.
-        processing.generate(winpath)
+        self._record_run(processing.generate(winpath))
 
-        host = self._process_host(path)
-        self._process_generation(path, host)
+        with transaction.atomic():
+            host = self._process_host(path)
+            self._process_generation(path, host)
 
     def _process_host(self, path):
         # Fetch the host file and parse it.
@@ -248,7 +432,7 @@ class Game(models.Model):
                 "Expected one hst file, found {0}.".format(len(hst_files)))
 
         with open(hst_files[0], 'rb') as f:
-            hst = StarsFile.from_data(f.read())
+            hst = StarsFile.from_data(f.read(), lazy=True)
 
         return hst
 
@@ -267,10 +451,8 @@ class Game(models.Model):
         races = dict((r.player_number, r)
                      for r in self.races.filter(player_number__isnull=False))
 
-        for r in host._sfile.structs:
-            if r.type != 6:  # Type 6 is the Race data structure.
-                continue
-
+        new_races, renamed = [], []
+        for r in host._sfile.decode(6):  # Type 6 is the Race data structure.
             race_obj = races.get(r.player)
 
             # Grab the name and plural name out of the race struct.
@@ -281,57 +463,66 @@ class Game(models.Model):
             # If the race object doesn't exist yet, it's an AI player,
             # so create it.
             if race_obj is None:
-                self.races.create(name=name, plural_name=plural_name,
-                                  is_ai=True, player_number=r.player)
+                new_races.append(Race(game=self, name=name, plural_name=plural_name,
+                                      is_ai=True, player_number=r.player))
                 continue
 
             # Update the player race names if they got bumped due to a conflict.
             if (race_obj.name != name or race_obj.plural_name != plural_name):
-                Race.objects.filter(pk=race_obj.pk).update(
-                    name=name, plural_name=plural_name)
+                race_obj.name, race_obj.plural_name = name, plural_name
+                renamed.append(race_obj)
+
+        Race.objects.bulk_create(new_races)
+        bulk_update(renamed, ['name', 'plural_name'])
 
         self._process_generation(path, host)
 
     def _process_generation(self, path, host):
         # Create the new turn with host file attached.
-        turn = self.turns.create(year=2400 + host._sfile.structs[0].turn,
-                                 hstfile=host)
+        turn = self.turns.create(year=host.year, hstfile=host)
 
         # Process the m files.
         races = dict((r.player_number, r)
                      for r in self.races.filter(player_number__isnull=False))
         scores = {}
-        scores_unmatched = set((race, section) for race in races
-                               for sfield, section in Score.FIELDS)
-
-        for m_name in glob.glob('{0}/*.m[0-9]*'.format(path)):
+        canonical = {}
+        raceturns = []
+
+        packets = getattr(settings, 'STARSWEB_TURN_PACKETS', False)
+        xy = None
+        if packets and self.mapfile is not None:
+            xy = self.mapfile.read()
+
+        # Parsing the m files is CPU bound, so it is fanned out to a pool
+        # of processes, leaving only the database work to this one.
+        m_names = glob.glob('{0}/*.m[0-9]*'.format(path))
+        for m_name, player, mscores in parsing.extract_all_scores(m_names, Score.FIELDS):
             with open(m_name, 'rb') as f:
-                mfile = StarsFile.from_data(f.read())
-
-            structs = mfile._sfile.structs
-            player = structs[0].player
+                mdata = f.read()
+            mfile = StarsFile.from_data(mdata, lazy=True)
 
             # Create a new Race-Turn intermediate table entry, with
             # the m file attached.
-            turn.raceturns.create(race=races[player], mfile=mfile)
+            raceturn = RaceTurn(turn=turn, race=races[player], mfile=mfile)
+            if packets:
+                raceturn.packet = self._make_packet(player, mdata, xy)
+            raceturns.append(raceturn)
 
-            for S in structs:
-                if S.type != 45:  # Type 45 is the Score data structure.
-                    continue
+            for score_player, section, value in mscores:
+                # Save all scores from this file, to potentially
+                # fill in any blanks in the record.
+                scores.setdefault((score_player, section), set()).add(value)
 
-                for sfield, section in Score.FIELDS:
-                    value = getattr(S, sfield, 0)
+                # A player's own score record is canonical, so use
+                # that if available.
+                if score_player == player:
+                    canonical[(score_player, section)] = value
 
-                    # Save all scores from this file, to potentially
-                    # fill in any blanks in the record.
-                    scores.setdefault((S.player, section), set()).add(value)
+        RaceTurn.objects.bulk_create(raceturns)
 
-                    # A player's own score record is canonical, so use
-                    # that if available.
-                    if S.player == player:
-                        turn.scores.create(
-                            race=races[player], section=section, value=value)
-                        scores_unmatched.remove((S.player, section))
+        scores_unmatched = set((race, section) for race in races
+                               for sfield, section in Score.FIELDS
+                               if (race, section) not in canonical)
 
         # If there are any blank scores left over, fill them in with
         # data from the other m files.
@@ -353,10 +544,46 @@ class Game(models.Model):
                             self.id, player, section)
                     )
 
-                turn.scores.create(
-                    race=races[player], section=section,
-                    value=max(scores[(player, section)])
-                )
+                canonical[(player, section)] = max(scores[(player, section)])
+
+        race_scores = {}
+        for (player, section), value in canonical.items():
+            race_scores.setdefault(player, {})[
+                Score.TOKEN_VALUES[section]] = value
+        RaceScore.objects.bulk_create(
+            RaceScore(turn=turn, race=races[player], **values)
+            for player, values in sorted(race_scores.items())
+        )
+
+        # Imported here, since these modules import this one.
+        from . import scores as score_artefacts, signals
+        # Writing the artefact removes the previous turn's, so wait until
+        # the new turn is committed and there is no going back to it.
+        # Without one, the score views fall back to the score table.
+        def write_artefact():
+            try:
+                score_artefacts.write_artefact(self, turn.year)
+            except Exception:
+                logger.exception(
+                    "Writing the score artefact failed for game '{game.name}'"
+                    " (pk={game.pk}).".format(game=self))
+        transaction.on_commit(write_artefact)
+
+        signals.turn_generated.send(sender=Game, instance=self, turn=turn)
+
+    def _make_packet(self, player, mdata, xy):
+        # Named as the download views name the files.
+        prefix = self.slug[:8]
+        now = time.localtime()
+        members = [('{0}.m{1}'.format(prefix, player + 1), [mdata], now)]
+        if xy is not None:
+            members.append(('{0}.xy'.format(prefix), [xy], now))
+
+        packet = StarsFile(type='zip')
+        packet.file.save('zip', ContentFile(b''.join(
+            zipstream.zip_stream(members))), save=False)
+        packet.save()
+        return packet
 
 
 class GameOptions(models.Model):
@@ -561,8 +788,10 @@ class Race(models.Model):
 
     @property
     def all_ambassadors(self):
-        if self.ambassadors.exists():
-            return u' / '.join(six.text_type(a) for a in self.ambassadors.all())
+        # Goes through .all() so that prefetched ambassadors are used.
+        ambassadors = self.ambassadors.all()
+        if ambassadors:
+            return u' / '.join(six.text_type(a) for a in ambassadors)
 
     @property
     def number(self):
@@ -649,6 +878,43 @@ class Turn(models.Model):
     def __str__(self):
         return six.text_type(self.year)
 
+    def save(self, *args, **kwargs):
+        created = self.pk is None
+        super(Turn, self).save(*args, **kwargs)
+
+        # A new turn is always the game's latest.
+        if created:
+            Game.objects.filter(pk=self.game_id).update(
+                latest_turn=self, last_generated=self.generated,
+                modified=self.generated)
+            self.game.latest_turn = self
+            self.game.last_generated = self.generated
+            self.game.modified = self.generated
+
+
+@python_2_unicode_compatible
+class GenerationLog(models.Model):
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='generation_logs')
+    timestamp = models.DateTimeField(auto_now_add=True)
+    commandline = models.TextField()
+    returncode = models.IntegerField(null=True)
+    stdout = models.TextField(blank=True)
+    stderr = models.TextField(blank=True)
+    elapsed = models.FloatField()
+    cpu_time = models.FloatField()
+    max_rss = models.IntegerField(help_text="Peak resident set size, in KiB.")
+    timed_out = models.BooleanField(default=False)
+    killed = models.BooleanField(default=False)
+    orphaned = models.BooleanField(default=False)
+    startup_saved = models.FloatField(null=True)
+
+    class Meta:
+        get_latest_by = 'timestamp'
+        ordering = ('-timestamp',)
+
+    def __str__(self):
+        return u"{0} ({1})".format(self.commandline, self.timestamp)
+
 
 class RaceTurn(models.Model):
     race = models.ForeignKey(Race, on_delete=models.CASCADE, related_name='raceturns')
@@ -658,11 +924,21 @@ class RaceTurn(models.Model):
     xfile = models.ForeignKey(StarsFile, on_delete=models.SET_NULL, null=True, related_name='xraceturn')
     xfile_official = models.ForeignKey(StarsFile, on_delete=models.SET_NULL, null=True,
                                        related_name='official_xraceturn')
+    # A zip of the m file and the game's map, built at generation if
+    # STARSWEB_TURN_PACKETS is set.
+    packet = models.ForeignKey(StarsFile, on_delete=models.SET_NULL, null=True,
+                               blank=True, related_name='packetraceturn')
     uploads = models.IntegerField(default=0)
 
 
 @python_2_unicode_compatible
 class Score(models.Model):
+    """One score section of a race for one turn.
+
+    Scores are now stored in ``RaceScore``; this model keeps the section
+    constants, and the rows from before the move.
+
+    """
     RANK = 0
     SCORE = 1
     RESOURCES = 2
@@ -721,6 +997,36 @@ class Score(models.Model):
         return u"{0}: {1}".format(self.get_section_display(), self.value)
 
 
+@python_2_unicode_compatible
+class RaceScore(models.Model):
+    """All of a race's score sections for one turn, in one row.
+
+    Each section is a column named by its ``Score.TOKENS`` token.
+
+    """
+    turn = models.ForeignKey(Turn, on_delete=models.CASCADE,
+                             related_name='race_scores')
+    race = models.ForeignKey(Race, on_delete=models.CASCADE,
+                             related_name='race_scores')
+
+    rank = models.IntegerField(null=True, blank=True)
+    score = models.IntegerField(null=True, blank=True)
+    resources = models.IntegerField(null=True, blank=True)
+    techlevels = models.IntegerField(null=True, blank=True)
+    capships = models.IntegerField(null=True, blank=True)
+    escortships = models.IntegerField(null=True, blank=True)
+    unarmedships = models.IntegerField(null=True, blank=True)
+    starbases = models.IntegerField(null=True, blank=True)
+    planets = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-turn', 'race')
+        unique_together = ('turn', 'race')
+
+    def __str__(self):
+        return u"{0}: {1}".format(self.race, self.score)
+
+
 @python_2_unicode_compatible
 class Star(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
@@ -0,0 +1,146 @@
+from __future__ import absolute_import
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if hasattr(v, 'isoformat') else v for v in values]
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        cursor = str(cursor)
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(data.decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def _after(fields, values, descending):
+    # Rows that sort strictly after ``values`` on ``fields``, written out
+    # so that the database can walk an index on the same columns.
+    lookup = 'lt' if descending else 'gt'
+    q = Q()
+    for i, field in enumerate(fields):
+        prefix = dict(zip(fields[:i], values[:i]))
+        prefix['{0}__{1}'.format(field, lookup)] = values[i]
+        q |= Q(**prefix)
+    return q
+
+
+class KeysetPage(object):
+    def __init__(self, object_list, has_next, has_previous, key):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._key = key
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_cursor(self):
+        if self._has_next:
+            return encode_cursor(self._key(self.object_list[-1]))
+
+    def previous_cursor(self):
+        if self._has_previous:
+            return encode_cursor(self._key(self.object_list[0]))
+
+
+class KeysetPaginator(object):
+    """Cursor pagination over a descending ordering.
+
+    The rows are ordered on ``nullable`` then ``fields``, all descending,
+    with rows where ``nullable`` is null coming after all the others.
+    The null and non-null rows are fetched as two partitions, each
+    ordered on plain columns, so a page is found by an index seek from
+    its cursor instead of by counting past every earlier row; the last
+    page costs the same as the first.
+
+    ``nullable`` and all but the last of ``fields`` are datetime columns;
+    the last field must be unique, such as the primary key.
+
+    """
+
+    def __init__(self, queryset, per_page, nullable, fields):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.nullable = nullable
+        self.fields = tuple(fields)
+
+    def _key(self, obj):
+        return [getattr(obj, f) for f in (self.nullable,) + self.fields]
+
+    def _decode(self, cursor):
+        values = decode_cursor(cursor, len(self.fields) + 1)
+        for i, value in enumerate(values[:-1]):
+            if value is None and i == 0:
+                continue
+            try:
+                values[i] = parse_datetime(value)
+            except (TypeError, ValueError):
+                values[i] = None
+            if values[i] is None:
+                raise InvalidCursor(cursor)
+        return values
+
+    def _partition(self, null, values, descending, limit):
+        # Up to ``limit`` rows from one partition, starting after
+        # ``values`` (or from the partition's start) in the given order.
+        fields = self.fields if null else (self.nullable,) + self.fields
+        queryset = self.queryset.filter(
+            **{'{0}__isnull'.format(self.nullable): null})
+        if values is not None:
+            queryset = queryset.filter(
+                _after(fields, values[1:] if null else values, descending))
+        sign = '-' if descending else ''
+        return list(queryset.order_by(*[sign + f for f in fields])[:limit])
+
+    def page(self, after=None, before=None):
+        """Return the page following ``after``, the page preceding
+        ``before``, or else the first page."""
+        n = self.per_page
+
+        if before is not None:
+            values = self._decode(before)
+            in_nulls = values[0] is None
+            rows = self._partition(in_nulls, values, False, n + 1)
+            if in_nulls and len(rows) <= n:
+                rows += self._partition(False, None, False, n + 1 - len(rows))
+            has_previous = len(rows) > n
+            return KeysetPage(rows[:n][::-1], True, has_previous, self._key)
+
+        values = None if after is None else self._decode(after)
+        in_nulls = values is not None and values[0] is None
+        rows = self._partition(in_nulls, values, True, n + 1)
+        if not in_nulls and len(rows) <= n:
+            rows += self._partition(True, None, True, n + 1 - len(rows))
+        return KeysetPage(rows[:n], len(rows) > n, values is not None,
+                          self._key)
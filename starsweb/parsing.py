@@ -0,0 +1,429 @@
+from __future__ import absolute_import
+from collections import Counter, OrderedDict, namedtuple
+from functools import partial
+import hashlib
+import json
+import logging
+import multiprocessing
+import numbers
+import struct
+import sys
+import threading
+from types import ModuleType
+
+from django.conf import settings
+import six
+from starslib import base
+
+logger = logging.getLogger(__name__)
+
+
+# Block types with a special meaning to the scanner.
+FOOTER = 0
+PLANETS = 7
+HEADER = 8
+
+FILE_TYPES = {0: 'xy', 1: 'x', 2: 'hst', 3: 'm', 4: 'h', 5: 'r'}
+
+MAX_YEAR = 32767
+
+Block = namedtuple('Block', 'type offset size')
+
+FileHeader = namedtuple('FileHeader', (
+    'magic game_id version turn player salt file_type flags'
+))
+
+CacheInfo = namedtuple('CacheInfo', (
+    'hits misses evictions entries memory max_memory'
+))
+
+
+def scan(data):
+    """Walk the block headers of a Stars! file without decoding anything.
+
+    Every block starts with a 16-bit little-endian header holding its
+    type in the top 6 bits and its size in the lower 10.  Scanning stops
+    at a planets block, since the planet data that follows it in xy
+    files isn't covered by the block size.
+
+    """
+    index = 0
+    while index < len(data):
+        if index + 2 > len(data):
+            raise ValueError(
+                "Truncated block header at offset {0}.".format(index))
+
+        hdr = struct.unpack('<H', data[index:index + 2])[0]
+        block = Block((hdr & 0xfc00) >> 10, index + 2, hdr & 0x03ff)
+        if block.offset + block.size > len(data):
+            raise ValueError(
+                "Truncated block of type {0} at offset {1}.".format(
+                    block.type, index))
+
+        yield block
+        if block.type == PLANETS:
+            return
+        index = block.offset + block.size
+
+
+def read_header(data):
+    """Read the file header block, which is never encrypted."""
+    blocks = scan(data)
+    block = next(blocks, None)
+    if block is None or block.type != HEADER or block.size < 16:
+        raise ValueError("Not a Stars! file.")
+
+    (magic, game_id, version, turn,
+     player_data, file_type, flags) = struct.unpack(
+        '<4sIHHHBB', data[block.offset:block.offset + 16])
+    if magic != b'J3J3':
+        raise ValueError("Not a Stars! file.")
+
+    return FileHeader(magic, game_id, version, turn, player_data & 0x1f,
+                      player_data >> 5, file_type, flags)
+
+
+class LazyStarsFile(object):
+    """A Stars! file that is only decoded as far as it needs to be.
+
+    The header and the block layout come from a cheap scan of the raw
+    bytes.  starslib has to decrypt blocks in order, so asking for
+    particular block types decodes the file up to the last block of those
+    types and no further; a host file's race blocks, for instance, come
+    before all of its planets and fleets.
+
+    """
+
+    def __init__(self, data):
+        self.bytes = data
+        self.header = read_header(data)
+        self.blocks = list(scan(data))
+        # Without a footer, the scan stopped early at a planets block.
+        self.complete = self.blocks[-1].type == FOOTER
+
+        self._sfile = None
+        self._decoded = 0
+
+    @property
+    def type(self):
+        return FILE_TYPES.get(self.header.file_type)
+
+    @property
+    def counts(self):
+        if not self.complete:
+            return self._decode(len(self.bytes)).counts
+        return self.scanned_counts
+
+    @property
+    def scanned_counts(self):
+        """Block counts from the scan alone, with nothing decoded.
+
+        For a file whose scan stopped at a planets block, these run up to
+        and include that block, but leave out whatever follows the planet
+        data.
+
+        """
+        return dict(Counter(b.type for b in self.blocks))
+
+    @property
+    def structs(self):
+        return self._decode(len(self.bytes)).structs
+
+    def _decode(self, end):
+        if self._sfile is None or self._decoded < end:
+            sfile = base.StarsFile()
+            sfile.bytes = self.bytes[:end]
+            self._sfile, self._decoded = sfile, end
+        return self._sfile
+
+    def decode(self, *types):
+        """Return the decoded structs of the given block types."""
+        if not self.complete:
+            return [S for S in self.structs if S.type in types]
+
+        ends = [b.offset + b.size for b in self.blocks if b.type in types]
+        if not ends:
+            return []
+
+        sfile = self._decode(max(ends))
+        return [S for S in sfile.structs if S.type in types]
+
+
+def file_metadata(data):
+    """Header-level facts about a Stars! file, keyed by StarsFile field.
+
+    Only the header and block layout are read, plus the race block of a
+    race file; the block counts are those of the scan, so an xy file's
+    planet data is never decrypted.  Anything that can't be made out is
+    left empty.
+
+    """
+    meta = {'game_uid': None, 'year': None, 'player_number': None,
+            'block_counts': '', 'race_name': '', 'plural_race_name': ''}
+    try:
+        sfile = LazyStarsFile(data)
+    except ValueError:
+        return meta
+
+    year = 2400 + sfile.header.turn
+    meta.update(game_uid=sfile.header.game_id,
+                # The year is stored in a PositiveSmallIntegerField.
+                year=year if year <= MAX_YEAR else None,
+                player_number=sfile.header.player)
+    meta['block_counts'] = json.dumps(sfile.scanned_counts, sort_keys=True)
+    try:
+        if sfile.type == 'r':
+            for race in sfile.decode(6):  # Type 6 is the Race data structure.
+                meta.update(race_name=race.race_name,
+                            plural_race_name=race.plural_race_name or '')
+    except Exception:
+        # starslib raises more than StarsError on malformed block data,
+        # and metadata is never worth refusing to store a file over.
+        logger.warning("Could not read the metadata of a %s file.",
+                       sfile.type, exc_info=True)
+    return meta
+
+
+IMMUTABLE = (bytes, six.text_type, numbers.Number, type(None))
+
+READ_ONLY_MESSAGE = ("Parsed files from the parse cache are shared and"
+                     " read-only; use parsing.writable for a copy that can"
+                     " be changed.")
+
+
+class ReadOnly(object):
+    """A view of a shared parsed file, or of one of its structs, that
+    refuses to have attributes set or deleted, or methods called.
+
+    Lists are handed out as tuples, dicts as ``ReadOnlyDict`` and other
+    objects as further read-only views, so nothing reachable through it
+    can be changed.  Each attribute is wrapped once and kept, so that
+    reading ``structs`` again costs nothing.  Use ``writable`` for a copy
+    that can be changed.
+
+    """
+    __slots__ = ('_target', '_attrs')
+
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_attrs', {})
+
+    def __getattr__(self, name):
+        try:
+            return self._attrs[name]
+        except KeyError:
+            pass
+        value = getattr(self._target, name)
+        if callable(value):
+            # A method could change the shared object behind our back.
+            raise AttributeError(READ_ONLY_MESSAGE)
+        value = self._attrs[name] = read_only(value)
+        return value
+
+    def __setattr__(self, name, value):
+        raise AttributeError(READ_ONLY_MESSAGE)
+
+    __delattr__ = __setattr__
+
+    def __repr__(self):
+        return '<ReadOnly {0!r}>'.format(self._target)
+
+
+class ReadOnlyDict(dict):
+    def _refuse(self, *args, **kwargs):
+        raise TypeError(READ_ONLY_MESSAGE)
+
+    __setitem__ = __delitem__ = _refuse
+    clear = pop = popitem = setdefault = update = _refuse
+
+
+def read_only(value):
+    if isinstance(value, IMMUTABLE):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(read_only(item) for item in value)
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, read_only(item))
+                            for key, item in value.items())
+    return ReadOnly(value)
+
+
+def parsed_size(sfile):
+    """Estimate the memory held by a parsed file, in bytes.
+
+    Adds up ``sys.getsizeof`` over the objects reachable from it through
+    containers and instance dicts, counting each object once.  Classes,
+    modules and functions are shared with everything else, so are left
+    out.
+
+    """
+    seen = set()
+    stack = [sfile]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or callable(obj) or isinstance(obj, ModuleType):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(vars(obj))
+    return total
+
+
+class ParseCache(object):
+    """A bounded LRU cache of parsed starslib files, keyed by content digest.
+
+    Since the key is the hash of the file's bytes, an entry can never go
+    stale.  Parsed files are handed out wrapped in ``ReadOnly``, since
+    they are shared between callers; ``writable`` makes a private copy
+    that can be changed.
+
+    The cache holds at most ``max_memory`` bytes of parsed files, as
+    estimated by ``parsed_size`` when each is parsed.
+
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest, load):
+        """Return the parsed file for ``digest``, calling ``load`` for its
+        bytes on a miss."""
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is not None:
+                self._entries[digest] = entry
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        data = load()
+        sfile = base.StarsFile()
+        sfile.bytes = data
+        size = parsed_size(sfile)
+        sfile = ReadOnly(sfile)
+
+        if size <= self.max_memory:
+            with self._lock:
+                if digest not in self._entries:
+                    self._entries[digest] = (sfile, size)
+                    self.memory += size
+                    self._evict()
+        return sfile
+
+    def parse(self, data):
+        return self.get(hashlib.sha256(data).hexdigest(), lambda: data)
+
+    def _evict(self):
+        while self.memory > self.max_memory:
+            digest, (sfile, size) = self._entries.popitem(last=False)
+            self.memory -= size
+            self.evictions += 1
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             len(self._entries), self.memory,
+                             self.max_memory)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+
+
+def writable(sfile):
+    """Return a private copy of a shared parsed file, safe to modify."""
+    copy = base.StarsFile()
+    copy.bytes = sfile.bytes
+    return copy
+
+
+_cache_lock = threading.Lock()
+_parse_cache = None
+
+
+def parse_cache():
+    # The process-wide ParseCache, holding up to STARSWEB_PARSE_CACHE_MEMORY
+    # bytes of parsed files (0 turns caching off).
+    global _parse_cache
+
+    with _cache_lock:
+        if _parse_cache is None:
+            _parse_cache = ParseCache(
+                getattr(settings, 'STARSWEB_PARSE_CACHE_MEMORY',
+                        64 * 1024 * 1024))
+        return _parse_cache
+
+
+def extract_scores(m_name, fields):
+    """Read an m file and pull out its player number and score values.
+
+    This runs in a worker process, so it hands back only plain data:
+    ``(m_name, player, [(score_player, section, value), ...])``.
+
+    """
+    with open(m_name, 'rb') as f:
+        sfile = LazyStarsFile(f.read())
+
+    scores = [(S.player, section, getattr(S, sfield, 0))
+              for S in sfile.decode(45)  # Type 45 is the Score data structure.
+              for sfield, section in fields]
+    return m_name, sfile.header.player, scores
+
+
+_pool_lock = threading.Lock()
+_parse_pool = None
+
+
+def parse_pool():
+    """The process-wide pool for parsing, or None to parse in-process.
+
+    The pool is created on first use with ``STARSWEB_PARSE_WORKERS``
+    processes (by default one per CPU) and shared by every generation in
+    this process, however many run at once.  Its workers are spawned
+    rather than forked where possible, since turn generation may be
+    running in several threads.  A daemonic process, such as a Celery
+    prefork worker, is not allowed children, so it parses in-process.
+
+    """
+    global _parse_pool
+
+    if multiprocessing.current_process().daemon:
+        return None
+
+    with _pool_lock:
+        if _parse_pool is None:
+            workers = getattr(settings, 'STARSWEB_PARSE_WORKERS', None)
+            if workers is None:
+                workers = multiprocessing.cpu_count()
+            if workers <= 1:
+                return None
+
+            context = multiprocessing
+            if hasattr(multiprocessing, 'get_context'):
+                context = multiprocessing.get_context('spawn')
+            _parse_pool = context.Pool(workers)
+        return _parse_pool
+
+
+def extract_all_scores(m_names, fields):
+    """Run extract_scores over several m files, in the parse pool."""
+    func = partial(extract_scores, fields=fields)
+    pool = parse_pool() if len(m_names) > 1 else None
+    if pool is None:
+        return [func(m_name) for m_name in m_names]
+    return pool.map(func, m_names)
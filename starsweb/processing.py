@@ -1,18 +1,282 @@
 from __future__ import absolute_import
+from collections import namedtuple
+import logging
+from multiprocessing.pool import ThreadPool
+import os
 import shlex
+import signal
+import socket
 import subprocess
+import tempfile
 import threading
+import time
 
 from django.conf import settings
+from django.db import connection
+import six
 
+logger = logging.getLogger(__name__)
 
-class Shared(object):
-    pass
 
+GenerationResult = namedtuple('GenerationResult', 'game error')
 
-def _target(obj, cmd):
-    obj.stars_process = subprocess.Popen(cmd)
-    obj.stars_process.communicate()
+ExecutionResult = namedtuple('ExecutionResult', (
+    'commandline returncode stdout stderr elapsed cpu_time max_rss'
+    ' timed_out killed orphaned startup_saved'
+))
+
+
+def new_session():
+    # Popen arguments to start the child in a session, and process group,
+    # of its own.  preexec_fn isn't safe with threads, and generations run
+    # in several, so it is only used on Python 2, where there is no other
+    # way.
+    if six.PY2:
+        return {'preexec_fn': os.setsid}
+    return {'start_new_session': True}
+
+
+class ProcessingError(Exception):
+    def __init__(self, message, result=None):
+        super(ProcessingError, self).__init__(message)
+        self.result = result
+
+
+_wine_lock = threading.Lock()
+_wine_semaphore = None
+
+
+def wine_slots():
+    # Bound the number of Stars! instances that may run under Wine at
+    # the same time, across every thread in this process.
+    global _wine_semaphore
+
+    with _wine_lock:
+        if _wine_semaphore is None:
+            _wine_semaphore = threading.BoundedSemaphore(
+                getattr(settings, 'STARSWEB_MAX_WINE_PROCESSES', 4))
+        return _wine_semaphore
+
+
+class WineServer(object):
+    """A persistent wineserver kept warm across Stars! runs.
+
+    Without it every ``wine`` invocation boots its own server and loads
+    the prefix from cold.  There can only be one server per prefix, and
+    it is shared by every worker process using that prefix, so its
+    health is checked by connecting to the prefix's server socket rather
+    than through whichever process happened to start it.  The server is
+    started to linger for ``STARSWEB_WINESERVER_LINGER`` seconds after
+    its last client goes away, so that no worker has to kill it out
+    from under the others when it exits.
+
+    """
+
+    def __init__(self, prefix=None, linger=None):
+        self.prefix = prefix
+        self.linger = linger if linger is not None else getattr(
+            settings, 'STARSWEB_WINESERVER_LINGER', 10 * 60)
+        self.boot_time = None
+        self.started = False
+        self.runs = 0
+        self.saved = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def env(self):
+        env = os.environ.copy()
+        if self.prefix:
+            env['WINEPREFIX'] = self.prefix
+        return env
+
+    def socket_path(self):
+        # Wine keys its server directory on the prefix's device and
+        # inode numbers, under /tmp whatever TMPDIR says.
+        prefix = self.prefix or os.path.join(os.path.expanduser('~'),
+                                             '.wine')
+        try:
+            st = os.stat(prefix)
+        except OSError:
+            return None
+        return '/tmp/.wine-{0}/server-{1:x}-{2:x}/socket'.format(
+            os.getuid(), st.st_dev, st.st_ino)
+
+    def is_alive(self):
+        path = self.socket_path()
+        if path is None:
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except socket.error:  # Missing, or left behind by a dead server.
+            return False
+        finally:
+            sock.close()
+        return True
+
+    def start(self):
+        # If another worker wins a race to start the server, this one's
+        # wineserver exits straight away and both use the winner's.
+        started = time.time()
+        subprocess.call(['wineserver', '-p{0}'.format(self.linger)],
+                        env=self.env)
+        subprocess.call(['wine', 'wineboot', '--init'], env=self.env)
+        self.boot_time = time.time() - started
+        self.started = True
+
+        logger.info("Started wineserver (prefix={0}), cold boot took"
+                    " {1:.2f}s.".format(self.prefix, self.boot_time))
+
+    def ensure(self):
+        with self.lock:
+            if not self.is_alive():
+                if self.started:
+                    logger.warning("wineserver (prefix={0}) has gone away,"
+                                   " restarting.".format(self.prefix))
+                self.start()
+        return self
+
+    def record_run(self):
+        """Count a run on the warm server, returning the estimated saving.
+
+        The estimate is the cold boot this process measured when it
+        started the server, which is roughly what each run avoids; it is
+        None in a process that found the server already running.
+
+        """
+        with self.lock:
+            self.runs += 1
+            if self.boot_time is None:
+                return None
+            self.saved += self.boot_time
+        logger.info("Stars! run used the warm wineserver, saving an"
+                    " estimated {0:.2f}s of Wine start-up ({1:.2f}s over {2}"
+                    " runs).".format(self.boot_time, self.saved, self.runs))
+        return self.boot_time
+
+    def stop(self):
+        with self.lock:
+            if self.is_alive():
+                subprocess.call(['wineserver', '-k'], env=self.env)
+
+
+_wineserver = None
+
+
+def wineserver():
+    # This process's WineServer, or None unless STARSWEB_WINE_PERSISTENT
+    # has been switched on.
+    global _wineserver
+
+    if not getattr(settings, 'STARSWEB_WINE_PERSISTENT', False):
+        return None
+
+    with _wine_lock:
+        if _wineserver is None:
+            _wineserver = WineServer(
+                getattr(settings, 'STARSWEB_WINEPREFIX', None))
+        return _wineserver
+
+
+class Supervisor(object):
+    """Run one Stars! command and record what it did.
+
+    The process gets a session of its own so that, once it has been
+    terminated or killed, any wine children it left behind can be swept
+    up with the rest of its process group.  Output goes to temporary
+    files rather than pipes, and the process is reaped with
+    ``os.wait4`` so that its resource usage can be reported.
+
+    """
+
+    def __init__(self, commandline, timeout, env=None, grace=None,
+                 sweep=False):
+        self.commandline = commandline
+        self.timeout = timeout
+        self.env = env
+        self.grace = grace if grace is not None else getattr(
+            settings, 'STARSWEB_KILL_GRACE', 10)
+        self.sweep = sweep
+
+        self.process = None
+        self.status = None
+        self.rusage = None
+
+    def _wait(self):
+        pid, self.status, self.rusage = os.wait4(self.process.pid, 0)
+
+    def _signal_group(self, signum):
+        try:
+            os.killpg(self.process.pid, signum)
+        except OSError:  # The whole group is already gone.
+            return False
+        return True
+
+    def _returncode(self):
+        if self.status is None:
+            return None
+        if os.WIFSIGNALED(self.status):
+            return -os.WTERMSIG(self.status)
+        return os.WEXITSTATUS(self.status)
+
+    @staticmethod
+    def _read(f):
+        f.seek(0)
+        return f.read().decode('latin-1')
+
+    def run(self):
+        timed_out, killed = False, False
+
+        with tempfile.TemporaryFile() as stdout, \
+                tempfile.TemporaryFile() as stderr:
+            started = time.time()
+            self.process = subprocess.Popen(
+                self.commandline, stdout=stdout, stderr=stderr,
+                env=self.env, **new_session())
+
+            waiter = threading.Thread(target=self._wait)
+            waiter.start()
+            waiter.join(self.timeout)
+
+            if waiter.is_alive():
+                timed_out = True
+                self._signal_group(signal.SIGTERM)
+                waiter.join(self.grace)
+
+                if waiter.is_alive():
+                    killed = True
+                    self._signal_group(signal.SIGKILL)
+                    waiter.join()
+
+            elapsed = time.time() - started
+
+            # Anything still in the process group at this point has been
+            # orphaned by the Stars! process.
+            orphaned = False
+            if timed_out or self.sweep:
+                orphaned = self._signal_group(signal.SIGKILL)
+                if orphaned:
+                    logger.warning(
+                        "Killed wine processes left behind by '{0}'.".format(
+                            ' '.join(self.commandline)))
+
+            # os.wait4 has already reaped the process, so keep Popen from
+            # trying to do so again.
+            self.process.returncode = self._returncode()
+
+            return ExecutionResult(
+                commandline=' '.join(self.commandline),
+                returncode=self.process.returncode,
+                stdout=self._read(stdout),
+                stderr=self._read(stderr),
+                elapsed=elapsed,
+                cpu_time=self.rusage.ru_utime + self.rusage.ru_stime,
+                max_rss=self.rusage.ru_maxrss,
+                timed_out=timed_out,
+                killed=killed,
+                orphaned=orphaned,
+                startup_saved=None,
+            )
 
 
 def activate(winpath):
@@ -20,7 +284,7 @@ def activate(winpath):
         r'wine C:\\stars\\stars!.exe'
         r' -a {winpath}game.def'.format(winpath=winpath)
     )
-    execute(commandline)
+    return execute(commandline)
 
 
 def generate(winpath):
@@ -28,16 +292,73 @@ def generate(winpath):
         r'wine C:\\stars\\stars\!.exe'
         r' -g {winpath}game.hst'.format(winpath=winpath)
     )
-    execute(commandline)
+    return execute(commandline)
 
 
 def execute(commandline):
-    obj = Shared()
-    thread = threading.Thread(target=_target, args=(obj, commandline))
-    thread.start()
-
-    thread.join(getattr(settings, 'STARSWEB_TIMEOUT', 5 * 60))
-    if thread.is_alive():
-        obj.stars_process.terminate()
-        thread.join()
-        raise Exception("Stars! timed out.")
+    server = wineserver()
+    env = None
+    if server is not None:
+        env = server.ensure().env
+
+    # Only a private, persistent wineserver makes it safe to kill
+    # leftover processes after a clean exit; otherwise they may be
+    # serving another Stars! run in the same prefix.
+    supervisor = Supervisor(commandline,
+                            getattr(settings, 'STARSWEB_TIMEOUT', 5 * 60),
+                            env=env, sweep=server is not None)
+
+    with wine_slots():
+        result = supervisor.run()
+
+    if server is not None:
+        result = result._replace(startup_saved=server.record_run())
+
+    logger.info("Stars! exited with code {r.returncode} after {r.elapsed:.2f}s"
+                " (cpu={r.cpu_time:.2f}s, max_rss={r.max_rss}KiB).".format(
+                    r=result))
+
+    if result.timed_out:
+        raise ProcessingError("Stars! timed out.", result)
+    return result
+
+
+def _generate_game(game):
+    try:
+        game.generate()
+    except Exception as e:
+        logger.exception(
+            "Generation failed for '{game.name}' (pk={game.pk}).".format(
+                game=game)
+        )
+        return GenerationResult(game, e)
+    finally:
+        # Each worker thread gets its own database connection, which
+        # would otherwise be left open once the pool shuts down.
+        connection.close()
+
+    return GenerationResult(game, None)
+
+
+def generate_games(games, workers=None):
+    """Generate several games concurrently.
+
+    Each game runs its own activation or generation in a worker thread,
+    while the number of simultaneous Stars! processes stays bounded by
+    ``STARSWEB_MAX_WINE_PROCESSES``.  A failure in one game is captured
+    in its ``GenerationResult`` instead of aborting the others.
+
+    """
+    games = list(games)
+    if not games:
+        return []
+
+    if workers is None:
+        workers = getattr(settings, 'STARSWEB_GENERATION_WORKERS', 4)
+
+    pool = ThreadPool(max(1, min(workers, len(games))))
+    try:
+        return pool.map(_generate_game, games)
+    finally:
+        pool.close()
+        pool.join()
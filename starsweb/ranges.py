@@ -0,0 +1,42 @@
+"""Single byte ranges, as asked for by an HTTP Range header."""
+from __future__ import absolute_import
+
+
+class Unsatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """Return the ``(first, last)`` byte positions asked for, inclusive.
+
+    Returns None for anything other than a single range of bytes, which
+    a server is free to answer with the whole representation.  Raises
+    ``Unsatisfiable`` if the range lies wholly outside ``size`` bytes.
+
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # A suffix range: the last so many bytes.
+            length = int(last)
+            if length < 0:
+                return None
+            if length == 0 or size == 0:
+                raise Unsatisfiable(header)
+            return max(0, size - length), size - 1
+
+        first = int(first)
+        last = int(last) if last else None
+    except ValueError:
+        return None
+    if first < 0 or (last is not None and last < first):
+        return None
+    if first >= size:
+        raise Unsatisfiable(header)
+    return first, size - 1 if last is None else min(last, size - 1)
@@ -0,0 +1,200 @@
+from __future__ import absolute_import, division
+import gzip
+import io
+import json
+import posixpath
+
+from django.core.files.base import ContentFile
+
+from . import models
+
+
+def score_matrix(game, sections=None, races=None, from_year=None,
+                 to_year=None):
+    """Collect a game's scores as ``{section token: {race: [values]}}``.
+
+    Each list holds one value per year from ``year_min`` to ``year_max``,
+    with None for years a race has no score.  Returns
+    ``(year_min, year_max, matrix)``; both years are None if there are
+    no matching scores.
+
+    """
+    if sections is None:
+        tokens = models.Score.TOKENS
+    else:
+        tokens = [models.Score.TOKEN_VALUES[s] for s in sections]
+
+    race_scores = models.RaceScore.objects.filter(turn__game=game)
+    if races:
+        race_scores = race_scores.filter(race__plural_name__in=races)
+    if from_year is not None:
+        race_scores = race_scores.filter(turn__year__gte=from_year)
+    if to_year is not None:
+        race_scores = race_scores.filter(turn__year__lte=to_year)
+
+    rows = [row for row in race_scores.order_by().values_list(
+                'turn__year', 'race__plural_name', *tokens)
+            if any(value is not None for value in row[2:])]
+    if not rows:
+        return None, None, {}
+
+    year_min = min(row[0] for row in rows)
+    year_max = max(row[0] for row in rows)
+
+    matrix = {}
+    for year, race, values in ((row[0], row[1], row[2:]) for row in rows):
+        for token, value in zip(tokens, values):
+            if value is None:
+                continue
+            series = matrix.setdefault(token, {}).get(race)
+            if series is None:
+                series = matrix[token][race] = [None] * (year_max - year_min + 1)
+            series[year - year_min] = value
+
+    return year_min, year_max, matrix
+
+
+def slice_matrix(year_min, matrix, sections=None, races=None,
+                 from_year=None, to_year=None):
+    """Filter a matrix from ``score_matrix`` as if ``score_matrix`` had
+    been given the same filters, except that ``sections`` are tokens.
+
+    Returns ``(year_min, year_max, matrix)``, trimmed to the years that
+    still have scores.
+
+    """
+    found = {}
+    for section, race_scores in matrix.items():
+        if sections is not None and section not in sections:
+            continue
+        for race, values in race_scores.items():
+            if races and race not in races:
+                continue
+            years = dict(
+                (year_min + i, v) for i, v in enumerate(values)
+                if v is not None
+                and (from_year is None or year_min + i >= from_year)
+                and (to_year is None or year_min + i <= to_year)
+            )
+            if years:
+                found.setdefault(section, {})[race] = years
+
+    if not found:
+        return None, None, {}
+
+    all_years = [year for race_scores in found.values()
+                 for years in race_scores.values() for year in years]
+    first, last = min(all_years), max(all_years)
+    return first, last, dict(
+        (section, dict(
+            (race, [years.get(year) for year in range(first, last + 1)])
+            for race, years in race_scores.items()))
+        for section, race_scores in found.items()
+    )
+
+
+def artefact_storage():
+    # Kept in the same storage as the game's StarsFiles.
+    return models.StarsFile._meta.get_field('file').storage
+
+
+def artefact_name(game, year):
+    """The storage name of a game's score artefact as of ``year``.  The
+    gzipped variant has ``.gz`` appended."""
+    return 'scores/{0}/{1}.json'.format(game.pk, year)
+
+
+def write_artefact(game, year):
+    """Store the game's whole score matrix, as JSON and gzipped JSON.
+
+    The document is what the score data view returns when asked for
+    everything, so that it can be sent as it is.  Each turn gets new
+    names, so a reader never sees a half-written artefact; those of
+    earlier turns are removed.
+
+    """
+    year_min, year_max, matrix = score_matrix(game)
+    data = json.dumps({
+        'year_min': year_min,
+        'year_max': year_max,
+        'current_year': year,
+        'scores': matrix,
+    }, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    packed = io.BytesIO()
+    with gzip.GzipFile(fileobj=packed, mode='wb', mtime=0) as f:
+        f.write(data)
+
+    storage = artefact_storage()
+    name = artefact_name(game, year)
+    for filename, content in ((name, data), (name + '.gz', packed.getvalue())):
+        if storage.exists(filename):
+            storage.delete(filename)
+        storage.save(filename, ContentFile(content))
+
+    directory, current = posixpath.split(name)
+    for filename in storage.listdir(directory)[1]:
+        if filename not in (current, current + '.gz'):
+            storage.delete(posixpath.join(directory, filename))
+
+
+def read_artefact(game, year):
+    """The parsed score artefact of a game as of ``year``, or None if
+    there isn't one."""
+    storage = artefact_storage()
+    name = artefact_name(game, year)
+    if not storage.exists(name):
+        return None
+    with storage.open(name) as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def lttb(points, threshold):
+    """Downsample ``[x, y]`` points with largest-triangle-three-buckets.
+
+    Keeps the first and last points and, from each of ``threshold - 2``
+    buckets in between, the point forming the largest triangle with the
+    previously kept point and the average of the next bucket.  That
+    preserves the peaks and troughs a line chart needs to look right.
+
+    """
+    if threshold < 3 or threshold >= len(points):
+        return list(points)
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket.
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(points))
+        bucket = points[avg_start:avg_end]
+        avg_x = sum(p[0] for p in bucket) / len(bucket)
+        avg_y = sum(p[1] for p in bucket) / len(bucket)
+
+        ax, ay = points[a]
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def downsample(matrix, year_min, points):
+    """Turn a score matrix's series into ``[year, value]`` pairs, with at
+    most ``points`` pairs per series.  Missing years are dropped."""
+    return dict(
+        (section, dict(
+            (race, lttb([[year_min + i, v] for i, v in enumerate(values)
+                         if v is not None], points))
+            for race, values in race_scores.items()))
+        for section, race_scores in matrix.items()
+    )
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import caching, models
+
+
+logger = logging.getLogger(__name__)
+
+
+# Sent by Game._process_generation, inside its transaction, once a new
+# turn and everything belonging to it has been stored.
+turn_generated = Signal(providing_args=['turn'])
+
+
+# Keep Game.modified current for changes made outside Game.save, so that
+# the game's pages can be validated against it (see conditional.py), and
+# drop the cached versions of the games' pages (see caching.py).
+# Turn.save bumps Game.modified itself when a turn is created.
+
+
+def touch_games(**filters):
+    games = models.Game.objects.filter(**filters)
+    caching.invalidate_games(games.values_list('slug', flat=True))
+    games.update(modified=timezone.now())
+
+
+@receiver(pre_save, sender=models.Game)
+def game_renamed(sender, instance, raw=False, **kwargs):
+    # Pages cached under the old slug must go too.
+    if instance.pk is not None and not raw:
+        caching.invalidate_games(models.Game.objects.filter(
+            pk=instance.pk).exclude(slug=instance.slug).values_list(
+                'slug', flat=True))
+
+
+@receiver(post_save, sender=models.Game)
+@receiver(post_delete, sender=models.Game)
+def game_changed(sender, instance, **kwargs):
+    caching.invalidate_games([instance.slug])
+
+
+@receiver(post_save, sender=models.Turn)
+def turn_saved(sender, instance, **kwargs):
+    caching.invalidate_games(models.Game.objects.filter(
+        pk=instance.game_id).values_list('slug', flat=True))
+
+
+@receiver(post_delete, sender=models.Turn)
+def turn_deleted(sender, instance, **kwargs):
+    # Deleting a game's latest turn nulls Game.latest_turn; go back to
+    # the newest turn still there, as Turn.save would have left it.
+    latest = models.Turn.objects.filter(
+        game=instance.game_id).order_by('-generated', '-pk').first()
+    models.Game.objects.filter(
+        pk=instance.game_id, latest_turn__isnull=True).update(
+            latest_turn=latest,
+            last_generated=latest.generated if latest else None)
+
+
+@receiver(post_save, sender=models.Race)
+@receiver(post_delete, sender=models.Race)
+@receiver(post_delete, sender=models.Turn)
+def game_child_changed(sender, instance, **kwargs):
+    touch_games(pk=instance.game_id)
+
+
+@receiver(post_save, sender=models.RacePage)
+@receiver(post_delete, sender=models.RacePage)
+@receiver(post_save, sender=models.Ambassador)
+@receiver(post_delete, sender=models.Ambassador)
+def race_child_changed(sender, instance, **kwargs):
+    touch_games(races=instance.race_id)
+
+
+@receiver(turn_generated)
+def warm_game(sender, instance, turn, **kwargs):
+    # Every player comes looking as soon as a turn is out, so build the
+    # game's cached data before they do; after the commit, so that it is
+    # built from the new turn and under the version the commit leaves.
+    def warm():
+        try:
+            caching.warm_game(instance)
+        except Exception:
+            logger.exception(
+                "Cache warm-up failed for game '{game.name}'"
+                " (pk={game.pk}).".format(game=instance))
+    transaction.on_commit(warm)
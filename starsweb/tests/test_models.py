@@ -1,14 +1,21 @@
 from __future__ import absolute_import
+import hashlib
+import importlib
+import io
 import os
 import shutil
+import zipfile
 
 from django.contrib.auth.models import User
-from django.core.files.base import File
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile, File
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from mock import patch
 
-from .. import models
+from .. import models, processing, scores
 
 PATH = os.path.dirname(__file__)
 
@@ -55,7 +62,142 @@ class StarsFileTestCase(TestCase):
         self.assertEqual(models.StarsFile.objects.count(), 2)
         sfile1, sfile2 = models.StarsFile.objects.all()
 
-        self.assertNotEqual(sfile1.file.path, sfile2.file.path)
+        # Identical content is stored once and shared by both rows.
+        self.assertEqual(sfile1.digest, sfile2.digest)
+        self.assertEqual(sfile1.file.path, sfile2.file.path)
+
+    def test_content_addressed_path(self):
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            data = f.read()
+
+        starsfile = models.StarsFile.from_data(data)
+        digest = hashlib.sha256(data).hexdigest()
+
+        self.assertEqual(starsfile.digest, digest)
+        self.assertEqual(starsfile.file.name, 'map/{0}/{1}/{2}'.format(
+            digest[:2], digest[2:4], digest))
+
+    def test_digest_backfill_moves_old_blobs(self):
+        from django.apps import apps
+        migration = importlib.import_module(
+            'starsweb.migrations.0003_starsfile_digest')
+
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            data = f.read()
+        storage = models.StarsFile._meta.get_field('file').storage
+        old_names = [storage.save('stars/2013/01/01/ulf_war.xy',
+                                  ContentFile(data))
+                     for i in range(2)]
+        for name in old_names:
+            models.StarsFile.objects.create(type='xy', file=name)
+
+        migration.fill_digests(apps, None)
+
+        digest = hashlib.sha256(data).hexdigest()
+        sfile1, sfile2 = models.StarsFile.objects.all()
+        self.assertEqual(sfile1.digest, digest)
+        self.assertEqual(sfile1.file.name, 'map/{0}/{1}/{2}'.format(
+            digest[:2], digest[2:4], digest))
+        self.assertEqual(sfile1.file.name, sfile2.file.name)
+        for name in old_names:
+            self.assertFalse(storage.exists(name))
+
+        # A new upload of the same content shares the moved blob.
+        starsfile = models.StarsFile.from_data(data)
+        self.assertEqual(starsfile.file.name, sfile1.file.name)
+
+    def test_changed_content_gets_a_new_blob(self):
+        with open(os.path.join(PATH, 'files', 'gestalti.r1'), 'rb') as f:
+            data = f.read()
+
+        sfile1 = models.StarsFile.from_data(data)
+        sfile2 = models.StarsFile.from_file(sfile1.file)
+        sfile2.file.save('', ContentFile(data + b'\x00'))
+
+        self.assertNotEqual(sfile1.file.name, sfile2.file.name)
+        sfile1.file.open('rb')
+        try:
+            self.assertEqual(sfile1.file.read(), data)
+        finally:
+            sfile1.file.close()
+
+    @override_settings(STARSWEB_COMPRESSION='zlib')
+    def test_compressed_storage(self):
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            data = f.read()
+
+        starsfile = models.StarsFile.from_data(data)
+
+        self.assertEqual(starsfile.compression, 'zlib')
+        self.assertTrue(starsfile.file.name.endswith('.zlib'))
+        self.assertLess(starsfile.file.size, len(data))
+        self.assertEqual(starsfile.digest, hashlib.sha256(data).hexdigest())
+
+        starsfile = models.StarsFile.objects.get(pk=starsfile.pk)
+        self.assertEqual(starsfile.read(), data)
+        self.assertEqual(models.StarsFile.from_file(starsfile.file)._data,
+                         data)
+
+    @override_settings(STARSWEB_COMPRESSION='zlib')
+    def test_incompressible_stored_as_is(self):
+        with open(os.path.join(PATH, 'files', 'game.m1'), 'rb') as f:
+            data = f.read()
+
+        starsfile = models.StarsFile.from_data(data)
+
+        self.assertEqual(starsfile.compression, '')
+        self.assertEqual(starsfile.file.size, len(data))
+        self.assertEqual(starsfile.read(), data)
+
+    @override_settings(STARSWEB_COMPRESSION='bogus')
+    def test_unknown_compression(self):
+        with open(os.path.join(PATH, 'files', 'game.m1'), 'rb') as f:
+            data = f.read()
+
+        with self.assertRaises(ImproperlyConfigured):
+            models.StarsFile.from_data(data)
+
+    def test_metadata(self):
+        with open(os.path.join(PATH, 'files', 'game.m2'), 'rb') as f:
+            mfile = models.StarsFile.from_data(f.read())
+        with open(os.path.join(PATH, 'files', 'gestalti.r1'), 'rb') as f:
+            rfile = models.StarsFile.from_data(f.read())
+
+        mfile = models.StarsFile.objects.get(pk=mfile.pk)
+        self.assertEqual(mfile.player_number, 1)
+        self.assertEqual(mfile.year, 2401)
+        self.assertIsNotNone(mfile.game_uid)
+        self.assertEqual(mfile.counts, mfile.parsed().counts)
+        self.assertEqual(mfile.race_name, '')
+
+        rfile = models.StarsFile.objects.get(pk=rfile.pk)
+        self.assertEqual(rfile.counts, {8: 1, 6: 1, 0: 1})
+        self.assertEqual(rfile.race_name,
+                         rfile.parsed().structs[1].race_name)
+        self.assertTrue(models.StarsFile.objects.filter(
+            race_name=rfile.race_name, type='r').exists())
+
+    def test_metadata_unreadable(self):
+        starsfile = models.StarsFile(type='m')
+        starsfile.file.save('', ContentFile(b"turn 2400"))
+
+        self.assertIsNone(starsfile.player_number)
+        self.assertIsNone(starsfile.year)
+        self.assertIsNone(starsfile.counts)
+
+    def test_race_names_fallback(self):
+        with open(os.path.join(PATH, 'files', 'gestalti.r1'), 'rb') as f:
+            rfile = models.StarsFile.from_data(f.read())
+        race_struct = rfile.parsed().structs[1]
+        names = (race_struct.race_name, race_struct.plural_race_name)
+
+        self.assertEqual(rfile.race_names(), names)
+
+        # As for files stored before their names were read.
+        models.StarsFile.objects.filter(pk=rfile.pk).update(
+            race_name='', plural_race_name='')
+        rfile = models.StarsFile.objects.get(pk=rfile.pk)
+        self.assertEqual(rfile.race_names(), names)
 
     def test_parse(self):
         with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
@@ -77,6 +219,13 @@ class GameTestCase(TestCase):
         for starsfile in models.StarsFile.objects.all():
             starsfile.file.delete()
 
+        storage = scores.artefact_storage()
+        for turn in models.Turn.objects.select_related('game'):
+            name = scores.artefact_name(turn.game, turn.year)
+            for filename in (name, name + '.gz'):
+                if storage.exists(filename):
+                    storage.delete(filename)
+
     def test_create_new_game(self):
         self.assertFalse(models.Game.objects.exists())
 
@@ -98,6 +247,54 @@ class GameTestCase(TestCase):
                          "<p>This <em>game</em> is foobared.</p>\n")
         self.assertIsNotNone(g.options)
 
+    def test_current_turn(self):
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user)
+        self.assertIsNone(g.current_turn)
+
+        g.turns.create(year=2400)
+        turn = models.Turn.objects.create(game=g, year=2401)
+
+        g = models.Game.objects.get(pk=g.pk)
+        self.assertEqual(g.latest_turn, turn)
+        self.assertEqual(g.current_turn, turn)
+        self.assertEqual(g.current_turn, g.turns.latest())
+
+    @patch('starsweb.models.Game._generate')
+    def test_generated_elsewhere(self, mock_generate):
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user, state='A')
+        g.turns.create(year=2400)
+        stale = models.Game.objects.get(pk=g.pk)
+        g.turns.create(year=2401)
+
+        stale.generate()
+        self.assertFalse(mock_generate.called)
+
+        models.Game.objects.get(pk=g.pk).generate()
+        self.assertTrue(mock_generate.called)
+
+    def test_latest_turn_deleted(self):
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user)
+        first = g.turns.create(year=2400)
+        g.turns.create(year=2401).delete()
+
+        g = models.Game.objects.get(pk=g.pk)
+        self.assertEqual(g.current_turn, first)
+        self.assertEqual(g.last_generated, first.generated)
+
+        # An older turn going leaves the latest alone.
+        second = g.turns.create(year=2401)
+        first.delete()
+        g = models.Game.objects.get(pk=g.pk)
+        self.assertEqual(g.current_turn, second)
+
+        second.delete()
+        g = models.Game.objects.get(pk=g.pk)
+        self.assertIsNone(g.current_turn)
+        self.assertIsNone(g.last_generated)
+
     def test_create_game_with_empty_description(self):
         self.assertFalse(models.Game.objects.exists())
 
@@ -116,6 +313,21 @@ class GameTestCase(TestCase):
         self.assertEqual(g.host.username, 'admin')
         self.assertEqual(g.description_html, "")
 
+    def test_make_packet(self):
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user)
+
+        packet = g._make_packet(1, b"turn 2400", b"map")
+        self.assertEqual(packet.type, 'zip')
+        archive = zipfile.ZipFile(io.BytesIO(packet.read()))
+        self.assertEqual(archive.namelist(), ['foobar.m2', 'foobar.xy'])
+        self.assertEqual(archive.read('foobar.m2'), b"turn 2400")
+        self.assertEqual(archive.read('foobar.xy'), b"map")
+
+        packet = g._make_packet(0, b"turn 2400", None)
+        archive = zipfile.ZipFile(io.BytesIO(packet.read()))
+        self.assertEqual(archive.namelist(), ['foobar.m1'])
+
     @patch('starsweb.processing.execute')
     def test_generate(self, mock_execute):
         def se_activate(lst):
@@ -163,7 +375,7 @@ class GameTestCase(TestCase):
         self.assertEqual(g.turns.count(), 1)
         turn = g.turns.get()
         self.assertEqual(turn.year, 2400)
-        self.assertEqual(turn.scores.count(), 0)
+        self.assertEqual(turn.race_scores.count(), 0)
         self.assertIsNotNone(turn.hstfile)
         self.assertEqual(turn.raceturns.filter(mfile__isnull=False).count(), 2)
 
@@ -178,7 +390,20 @@ class GameTestCase(TestCase):
         mock_execute.side_effect = se_generate
 
         # Generate a turn for already active game.
-        g.generate()
+        with patch('starsweb.models.transaction.on_commit') as on_commit:
+            g.generate()
+
+        # The score artefact is only written once the turn is committed,
+        # and failing to write it doesn't fail the generation.
+        self.assertIsNone(scores.read_artefact(g, 2401))
+        with patch('starsweb.scores.write_artefact',
+                   side_effect=IOError), \
+                patch('starsweb.models.logger') as mock_logger:
+            for args, kwargs in on_commit.call_args_list:
+                args[0]()
+        self.assertTrue(mock_logger.exception.called)
+        for args, kwargs in on_commit.call_args_list:
+            args[0]()
 
         g = models.Game.objects.get(pk=g.pk)
 
@@ -189,10 +414,152 @@ class GameTestCase(TestCase):
         self.assertEqual(g.turns.count(), 2)
         self.assertTrue(g.turns.filter(year=2401).exists())
         turn = g.turns.filter(year=2401).get()
-        self.assertEqual(turn.scores.count(), 2 * 9)
+        self.assertEqual(turn.race_scores.count(), 2)
         self.assertIsNotNone(turn.hstfile)
         self.assertEqual(turn.raceturns.filter(mfile__isnull=False).count(), 2)
 
+        artefact = scores.read_artefact(g, 2401)
+        self.assertEqual(artefact['current_year'], 2401)
+        self.assertEqual(len(artefact['scores']), 9)
+
+    def generate_players(self, mock_execute, players):
+        # Activate a game with the first ``players`` of the test races,
+        # then capture the queries made generating its next turn.
+        def se_activate(lst):
+            winpath = lst[-1]
+            path = os.path.dirname(winpath[2:].replace('\\', '/'))
+
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.hst'), path)
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.xy'), path)
+            for number in range(1, players + 1):
+                shutil.copy(
+                    os.path.join(PATH, 'files', 'foobar.m{0}'.format(number)),
+                    path)
+
+        def se_generate(lst):
+            winpath = lst[-1]
+            path = os.path.dirname(winpath[2:].replace('\\', '/'))
+
+            shutil.copy(os.path.join(PATH, 'files', 'game.hst'), path)
+            for number in range(1, players + 1):
+                shutil.copy(
+                    os.path.join(PATH, 'files', 'game.m{0}'.format(number)),
+                    path)
+
+        slug = 'foobar-{0}'.format(players)
+        g = models.Game.objects.create(name=slug, slug=slug,
+                                       host=self.user, state='S')
+        models.GameOptions.objects.create(game=g)
+
+        for name, racefile in (("Gestalti", 'gestalti.r1'),
+                               ("SSG", 'ssg.r1'))[:players]:
+            race = g.races.create(name=name, plural_name=name,
+                                  slug=name.lower())
+            with open(os.path.join(PATH, 'files', racefile), 'rb') as f:
+                race.racefile = models.StarsFile.from_file(File(f))
+            race.save()
+
+        mock_execute.side_effect = se_activate
+        g.generate()
+
+        g = models.Game.objects.get(pk=g.pk)
+        mock_execute.side_effect = se_generate
+        with CaptureQueriesContext(connection) as ctx:
+            g.generate()
+
+        return ctx.captured_queries, g.turns.get(year=2401)
+
+    @patch('starsweb.processing.execute')
+    def test_generate_batches_writes(self, mock_execute):
+        def writes(queries, table):
+            return sum(1 for q in queries
+                       if q['sql'].startswith('INSERT INTO "{0}"'.format(table)))
+
+        counts = []
+        for players in (1, 2):
+            queries, turn = self.generate_players(mock_execute, players)
+
+            # One statement each, whatever the number of players.
+            self.assertEqual(writes(queries, 'starsweb_raceturn'), 1)
+            self.assertEqual(writes(queries, 'starsweb_racescore'), 1)
+            # One per stored file: the hst and each m file.
+            self.assertEqual(writes(queries, 'starsweb_starsfile'),
+                             1 + players)
+            self.assertEqual(turn.raceturns.count(), players)
+            self.assertEqual(turn.race_scores.count(), players)
+
+            counts.append(len(queries) - players)
+
+        # Storing each m file is the only per-player query.
+        self.assertEqual(counts[0], counts[1])
+
+    @patch('starsweb.processing.execute')
+    def test_generate_records_run(self, mock_execute):
+        def se_activate(lst):
+            winpath = lst[-1]
+            path = os.path.dirname(winpath[2:].replace('\\', '/'))
+
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.hst'), path)
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.xy'), path)
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.m1'), path)
+            shutil.copy(os.path.join(PATH, 'files', 'foobar.m2'), path)
+
+            return processing.ExecutionResult(
+                commandline=' '.join(lst), returncode=0, stdout='',
+                stderr='fixme:wine', elapsed=12.5, cpu_time=3.25,
+                max_rss=65536, timed_out=False, killed=False, orphaned=False,
+                startup_saved=None)
+
+        mock_execute.side_effect = se_activate
+
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user, state='S')
+        models.GameOptions.objects.create(game=g)
+
+        r1 = g.races.create(name="Gestalti", plural_name="Gestalti",
+                            slug="gestalti")
+        with open(os.path.join(PATH, 'files', 'gestalti.r1'), 'rb') as f:
+            r1.racefile = models.StarsFile.from_file(File(f))
+            r1.save()
+
+        g.generate()
+
+        self.assertEqual(g.generation_logs.count(), 1)
+        log = g.generation_logs.get()
+        self.assertEqual(log.returncode, 0)
+        self.assertEqual(log.stderr, 'fixme:wine')
+        self.assertEqual(log.elapsed, 12.5)
+        self.assertEqual(log.cpu_time, 3.25)
+        self.assertEqual(log.max_rss, 65536)
+        self.assertFalse(log.timed_out)
+
+    @patch('starsweb.processing.execute')
+    def test_generate_records_timeout(self, mock_execute):
+        result = processing.ExecutionResult(
+            commandline='wine', returncode=-9, stdout='', stderr='',
+            elapsed=300.0, cpu_time=299.0, max_rss=65536, timed_out=True,
+            killed=True, orphaned=True, startup_saved=None)
+        mock_execute.side_effect = processing.ProcessingError(
+            "Stars! timed out.", result)
+
+        g = models.Game.objects.create(name="Foobar", slug="foobar",
+                                       host=self.user, state='S')
+        models.GameOptions.objects.create(game=g)
+
+        with patch.object(g, '_tempdir_remove') as mock_remove:
+            with self.assertRaises(processing.ProcessingError):
+                g.generate()
+
+            self.assertTrue(mock_remove.called)
+            shutil.rmtree(mock_remove.call_args[0][0])
+
+        self.assertEqual(g.generation_logs.count(), 1)
+        log = g.generation_logs.get()
+        self.assertTrue(log.timed_out)
+        self.assertTrue(log.killed)
+        self.assertTrue(log.orphaned)
+        self.assertEqual(log.returncode, -9)
+
 
 class GameOptionsTestCase(TestCase):
     def setUp(self):
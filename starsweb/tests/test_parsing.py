@@ -0,0 +1,326 @@
+from __future__ import absolute_import
+import hashlib
+import json
+import os
+
+from django.test import TestCase, override_settings
+
+from mock import patch
+from starslib import base
+
+from .. import models, parsing
+
+PATH = os.path.dirname(__file__)
+
+
+def read(filename):
+    with open(os.path.join(PATH, 'files', filename), 'rb') as f:
+        return f.read()
+
+
+def parsed_size(data):
+    sfile = base.StarsFile()
+    sfile.bytes = data
+    return parsing.parsed_size(sfile)
+
+
+class ScanTestCase(TestCase):
+    def test_blocks(self):
+        data = read('gestalti.r1')
+        blocks = list(parsing.scan(data))
+
+        self.assertEqual([b.type for b in blocks], [8, 6, 0])
+        self.assertEqual(blocks[0].offset, 2)
+        self.assertEqual(sum(b.size + 2 for b in blocks), len(data))
+
+    def test_stops_at_planets(self):
+        blocks = list(parsing.scan(read('ulf_war.xy')))
+
+        self.assertEqual(blocks[-1].type, parsing.PLANETS)
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            list(parsing.scan(read('game.m1')[:-3]))
+
+    def test_read_header(self):
+        header = parsing.read_header(read('game.m2'))
+
+        self.assertEqual(header.magic, b'J3J3')
+        self.assertEqual(header.turn, 1)
+        self.assertEqual(header.player, 1)
+        self.assertEqual(parsing.FILE_TYPES[header.file_type], 'm')
+
+    def test_not_a_stars_file(self):
+        with self.assertRaises(ValueError):
+            parsing.read_header(b'\x00\x00')
+
+
+class LazyStarsFileTestCase(TestCase):
+    def test_matches_full_parse(self):
+        for filename in ('game.hst', 'game.m1', 'gestalti.r1', '500years.x5',
+                         '500years.h5', 'ulf_war.xy'):
+            data = read(filename)
+            lazy = parsing.LazyStarsFile(data)
+            sfile = base.StarsFile()
+            sfile.bytes = data
+
+            self.assertEqual(lazy.type, sfile.type)
+            self.assertEqual(lazy.counts, sfile.counts)
+            self.assertEqual(lazy.header.turn, sfile.structs[0].turn)
+            self.assertEqual(lazy.header.player, sfile.structs[0].player)
+
+    def test_no_decoding_for_absent_blocks(self):
+        lazy = parsing.LazyStarsFile(read('foobar.m1'))
+
+        with patch('starslib.base.StarsFile') as mock_sfile:
+            self.assertEqual(lazy.decode(45), [])
+            self.assertEqual(lazy.counts[13], 2)
+
+        self.assertFalse(mock_sfile.called)
+
+    def test_decodes_only_a_prefix(self):
+        data = read('game.hst')
+        lazy = parsing.LazyStarsFile(data)
+
+        races = lazy.decode(6)
+
+        self.assertEqual(len(races), 2)
+        self.assertLess(lazy._decoded, len(data) // 10)
+
+        sfile = base.StarsFile()
+        sfile.bytes = data
+        self.assertEqual(
+            [(r.player, r.race_name) for r in races],
+            [(r.player, r.race_name) for r in sfile.structs if r.type == 6])
+
+    def test_scores(self):
+        data = read('game.m1')
+        lazy = parsing.LazyStarsFile(data)
+
+        scores = lazy.decode(45)
+
+        sfile = base.StarsFile()
+        sfile.bytes = data
+        expected = [S for S in sfile.structs if S.type == 45]
+        self.assertEqual(len(scores), 1)
+        for sfield, section in models.Score.FIELDS:
+            self.assertEqual(getattr(scores[0], sfield, 0),
+                             getattr(expected[0], sfield, 0))
+
+    def test_lazy_starsfile_parse(self):
+        sfile = models.StarsFile.parse(read('game.m1'), 'm', lazy=True)
+        self.assertIsInstance(sfile, parsing.LazyStarsFile)
+
+        with self.assertRaises(ValueError):
+            models.StarsFile.parse(read('game.m1'), 'hst', lazy=True)
+
+
+class FileMetadataTestCase(TestCase):
+    def test_year_out_of_range(self):
+        data = bytearray(read('game.m2'))
+        # The turn follows the magic, game id and version in the header.
+        data[12:14] = b'\xff\xff'
+
+        meta = parsing.file_metadata(bytes(data))
+
+        self.assertIsNone(meta['year'])
+        self.assertEqual(meta['player_number'], 1)
+
+    def test_unreadable_blocks_are_logged(self):
+        with patch.object(parsing.LazyStarsFile, 'decode',
+                          side_effect=IndexError), \
+                patch('starsweb.parsing.logger') as mock_logger:
+            meta = parsing.file_metadata(read('gestalti.r1'))
+
+        self.assertEqual(meta['race_name'], '')
+        self.assertEqual(meta['block_counts'], '{"0": 1, "6": 1, "8": 1}')
+        self.assertTrue(mock_logger.warning.called)
+
+    def test_map_is_not_decoded(self):
+        with patch('starslib.base.StarsFile') as mock_sfile:
+            meta = parsing.file_metadata(read('ulf_war.xy'))
+
+        self.assertFalse(mock_sfile.called)
+        counts = json.loads(meta['block_counts'])
+        self.assertEqual(counts[str(parsing.PLANETS)], 1)
+        self.assertEqual(counts[str(parsing.HEADER)], 1)
+
+
+class ExtractScoresTestCase(TestCase):
+    def test_extract_scores(self):
+        m_name = os.path.join(PATH, 'files', 'game.m2')
+        name, player, scores = parsing.extract_scores(
+            m_name, models.Score.FIELDS)
+
+        self.assertEqual(name, m_name)
+        self.assertEqual(player, 1)
+        self.assertEqual(len(scores), 9)
+        self.assertEqual(set(s[0] for s in scores), set([1]))
+        self.assertEqual(sorted(s[1] for s in scores),
+                         [section for sfield, section in models.Score.FIELDS])
+
+    def test_no_scores(self):
+        name, player, scores = parsing.extract_scores(
+            os.path.join(PATH, 'files', 'foobar.m1'), models.Score.FIELDS)
+
+        self.assertEqual(player, 0)
+        self.assertEqual(scores, [])
+
+    def reset_pool(self):
+        if parsing._parse_pool is not None:
+            parsing._parse_pool.terminate()
+            parsing._parse_pool.join()
+        parsing._parse_pool = None
+
+    def setUp(self):
+        self.reset_pool()
+        self.addCleanup(self.reset_pool)
+        self.m_names = [os.path.join(PATH, 'files', name)
+                        for name in ('game.m1', 'game.m2', 'foobar.m1')]
+
+    def test_pool_matches_serial(self):
+        with self.settings(STARSWEB_PARSE_WORKERS=1):
+            self.assertIsNone(parsing.parse_pool())
+            serial = parsing.extract_all_scores(self.m_names,
+                                                models.Score.FIELDS)
+
+        with self.settings(STARSWEB_PARSE_WORKERS=2):
+            pooled = parsing.extract_all_scores(self.m_names,
+                                                models.Score.FIELDS)
+
+        self.assertEqual([s[0] for s in pooled], self.m_names)
+        self.assertEqual(pooled, serial)
+
+    @override_settings(STARSWEB_PARSE_WORKERS=2)
+    def test_pool_is_shared(self):
+        pool = parsing.parse_pool()
+        self.assertIsNotNone(pool)
+        self.assertIs(parsing.parse_pool(), pool)
+
+    @override_settings(STARSWEB_PARSE_WORKERS=2)
+    def test_daemonic_process(self):
+        with patch('starsweb.parsing.multiprocessing.current_process') as mock:
+            mock.return_value.daemon = True
+
+            self.assertIsNone(parsing.parse_pool())
+            scores = parsing.extract_all_scores(self.m_names,
+                                                models.Score.FIELDS)
+
+        self.assertIsNone(parsing._parse_pool)
+        self.assertEqual([s[0] for s in scores], self.m_names)
+
+
+class ParseCacheTestCase(TestCase):
+    def test_hits_and_misses(self):
+        cache = parsing.ParseCache(1024 * 1024)
+        data = read('gestalti.r1')
+
+        sfile = cache.parse(data)
+        self.assertIs(cache.parse(data), sfile)
+        self.assertIs(cache.get(hashlib.sha256(data).hexdigest(), None), sfile)
+
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+        self.assertEqual(info.entries, 1)
+        self.assertGreater(info.memory, len(data))
+
+    def test_evicts_least_recently_used(self):
+        r1, ssg, xy = read('gestalti.r1'), read('ssg.r1'), read('ulf_war.xy')
+        cache = parsing.ParseCache(parsed_size(r1) + parsed_size(xy))
+
+        cache.parse(r1)
+        cache.parse(ssg)
+        cache.parse(r1)
+        cache.parse(xy)
+
+        info = cache.info()
+        self.assertEqual(info.evictions, 1)
+        self.assertLessEqual(info.memory, info.max_memory)
+
+        cache.parse(r1)
+        self.assertEqual(cache.info().hits, 2)
+        cache.parse(ssg)
+        self.assertEqual(cache.info().misses, 4)
+
+    def test_too_large_to_cache(self):
+        cache = parsing.ParseCache(0)
+        data = read('gestalti.r1')
+
+        self.assertIsNot(cache.parse(data), cache.parse(data))
+        self.assertEqual(cache.info().entries, 0)
+
+    def test_writable_copy(self):
+        cache = parsing.ParseCache(1024 * 1024)
+        data = read('gestalti.r1')
+
+        sfile = cache.parse(data)
+        name = sfile.structs[1].race_name
+        copy = parsing.writable(sfile)
+        copy.structs[1].race_name = 'Foobar'
+
+        self.assertNotEqual(copy.bytes, data)
+        self.assertEqual(cache.parse(data).structs[1].race_name, name)
+        self.assertEqual(cache.parse(data).bytes, data)
+
+    def test_shared_files_are_read_only(self):
+        cache = parsing.ParseCache(1024 * 1024)
+        data = read('gestalti.r1')
+
+        sfile = cache.parse(data)
+        race = sfile.structs[1]
+        name = race.race_name
+
+        with self.assertRaises(AttributeError):
+            race.race_name = 'Foobar'
+        with self.assertRaises(AttributeError):
+            sfile.bytes = b''
+        with self.assertRaises(AttributeError):
+            sfile.structs.append(race)
+        self.assertIs(sfile.structs, sfile.structs)
+
+
+        self.assertEqual(cache.parse(data).structs[1].race_name, name)
+        self.assertEqual(cache.parse(data).bytes, data)
+
+    def test_read_only_views(self):
+        class Struct(object):
+            def rename(self, name):
+                self.name = name
+
+        struct = Struct()
+        struct.name = 'Gestalti'
+        struct.values = {'planets': [struct], 'score': {'total': 5}}
+        view = parsing.ReadOnly(struct)
+
+        with self.assertRaises(AttributeError):
+            view.rename('Foobar')
+        with self.assertRaises(TypeError):
+            view.values['score']['total'] = 0
+        with self.assertRaises(AttributeError):
+            view.values['planets'][0].name = 'Foobar'
+        self.assertIs(view.values, view.values)
+        self.assertEqual(struct.name, 'Gestalti')
+        self.assertEqual(struct.values['score'], {'total': 5})
+
+    def test_parsed_size(self):
+        class Struct(object):
+            pass
+
+        small, large = Struct(), Struct()
+        small.data = b'x'
+        large.data = [b'x' * 1000, {'more': b'y' * 1000}]
+        large.parent = large
+
+        self.assertGreater(parsing.parsed_size(large),
+                           parsing.parsed_size(small) + 2000)
+
+    def test_starsfile_parsed(self):
+        starsfile = models.StarsFile.from_data(read('ssg.r1'))
+        try:
+            sfile = starsfile.parsed()
+
+            self.assertIs(models.StarsFile.objects.get(
+                pk=starsfile.pk).parsed(), sfile)
+            self.assertEqual(sfile.type, 'r')
+        finally:
+            starsfile.file.delete()
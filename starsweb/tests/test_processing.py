@@ -0,0 +1,378 @@
+from __future__ import absolute_import
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from mock import call, patch
+import six
+
+from .. import models, processing
+
+
+RESULT = processing.ExecutionResult(
+    commandline='wine', returncode=0, stdout='', stderr='', elapsed=1.0,
+    cpu_time=0.5, max_rss=1024, timed_out=False, killed=False,
+    orphaned=False, startup_saved=None)
+
+
+class FakeGame(object):
+    def __init__(self, pk, tracker, error=None):
+        self.pk = pk
+        self.name = "Game {0}".format(pk)
+        self.tracker = tracker
+        self.error = error
+
+    def generate(self):
+        self.tracker.enter()
+        try:
+            time.sleep(0.05)
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.tracker.exit()
+
+
+class ConcurrencyTracker(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def exit(self):
+        with self.lock:
+            self.running -= 1
+
+
+class GenerateGamesTestCase(TestCase):
+    def test_no_games(self):
+        self.assertEqual(processing.generate_games([]), [])
+
+    def test_games_run_concurrently(self):
+        tracker = ConcurrencyTracker()
+        games = [FakeGame(i, tracker) for i in range(6)]
+
+        results = processing.generate_games(games, workers=3)
+
+        self.assertEqual([r.game for r in results], games)
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertGreater(tracker.peak, 1)
+        self.assertLessEqual(tracker.peak, 3)
+
+    def test_failure_does_not_block_other_games(self):
+        tracker = ConcurrencyTracker()
+        error = Exception("Stars! timed out.")
+        games = [FakeGame(1, tracker), FakeGame(2, tracker, error=error),
+                 FakeGame(3, tracker)]
+
+        results = processing.generate_games(games, workers=2)
+
+        self.assertEqual(len(results), 3)
+        self.assertIsNone(results[0].error)
+        self.assertIs(results[1].error, error)
+        self.assertIsNone(results[2].error)
+
+
+class GenerateTurnsCommandTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin',
+                                             password='password')
+        self.due = self.make_game('due', orders=[True, True])
+        self.waiting = self.make_game('waiting', orders=[True, False])
+        self.setup = models.Game.objects.create(
+            name='setup', slug='setup', host=self.user, state='S')
+
+    def tearDown(self):
+        for starsfile in models.StarsFile.objects.all():
+            starsfile.file.delete()
+
+    def starsfile(self, type, content):
+        starsfile = models.StarsFile(
+            type=type, file=SimpleUploadedFile('.' + type, content))
+        starsfile.save()
+        return starsfile
+
+    def make_game(self, slug, orders):
+        game = models.Game.objects.create(name=slug, slug=slug,
+                                          host=self.user, state='A')
+        turn = game.turns.create(year=2400)
+        for number, submitted in enumerate(orders):
+            race = game.races.create(
+                name='Race {0}'.format(number),
+                plural_name='Races {0}'.format(number),
+                slug='race-{0}'.format(number), player_number=number)
+            race.ambassadors.create(user=self.user, name='Ambassador')
+            turn.raceturns.create(
+                race=race,
+                mfile=self.starsfile('m', slug.encode('ascii') + b'm'),
+                xfile=self.starsfile('x', slug.encode('ascii') + b'x')
+                if submitted else None)
+        # An inactive player never holds a turn up.
+        game.races.create(name='Absent', plural_name='Absent',
+                          slug='absent')
+        return game
+
+    @patch.object(models.Game, 'generate', autospec=True)
+    def test_due_games(self, mock_generate):
+        call_command('generate_turns')
+
+        self.assertEqual([c[0][0].slug for c in mock_generate.call_args_list],
+                         ['due'])
+
+    @patch.object(models.Game, 'generate', autospec=True)
+    def test_departed_ambassador(self, mock_generate):
+        # A race whose ambassador has left doesn't hold the game up.
+        models.Ambassador.objects.filter(
+            race__game=self.waiting, race__player_number=1).update(
+                active=False)
+        call_command('generate_turns')
+
+        self.assertEqual([c[0][0].slug for c in mock_generate.call_args_list],
+                         ['due', 'waiting'])
+
+    @patch.object(models.Game, 'generate', autospec=True)
+    def test_managed_games(self, mock_generate):
+        with patch('starsweb.management.commands.generate_turns'
+                   '.managed_games', return_value=[self.due.pk]):
+            call_command('generate_turns')
+
+        self.assertFalse(mock_generate.called)
+
+    @patch.object(models.Game, 'generate', autospec=True)
+    def test_named_games(self, mock_generate):
+        call_command('generate_turns', 'waiting', 'setup', workers=2)
+
+        self.assertEqual(
+            sorted(c[0][0].slug for c in mock_generate.call_args_list),
+            ['setup', 'waiting'])
+
+    @patch.object(models.Game, 'generate', autospec=True)
+    def test_failure(self, mock_generate):
+        mock_generate.side_effect = processing.ProcessingError("Timed out.")
+
+        with self.assertRaises(CommandError):
+            call_command('generate_turns', 'due', 'waiting',
+                         stderr=six.StringIO())
+        self.assertEqual(mock_generate.call_count, 2)
+
+
+class WineSlotsTestCase(TestCase):
+    def setUp(self):
+        processing._wine_semaphore = None
+
+    def tearDown(self):
+        processing._wine_semaphore = None
+
+    @override_settings(STARSWEB_MAX_WINE_PROCESSES=2)
+    def test_execute_is_bounded(self):
+        tracker = ConcurrencyTracker()
+
+        def se_run():
+            tracker.enter()
+            time.sleep(0.05)
+            tracker.exit()
+            return RESULT
+
+        with patch('starsweb.processing.Supervisor.run') as mock_run:
+            mock_run.side_effect = se_run
+
+            threads = [threading.Thread(target=processing.execute,
+                                        args=(['wine'],))
+                       for i in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(tracker.peak, 2)
+
+
+class WineServerTestCase(TestCase):
+    def setUp(self):
+        processing._wineserver = None
+
+    def tearDown(self):
+        processing._wineserver = None
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(processing.wineserver())
+
+    @override_settings(STARSWEB_WINE_PERSISTENT=True,
+                       STARSWEB_WINEPREFIX='/srv/stars/wine')
+    def test_shared_server(self):
+        server = processing.wineserver()
+
+        self.assertIsInstance(server, processing.WineServer)
+        self.assertIs(processing.wineserver(), server)
+        self.assertEqual(server.env['WINEPREFIX'], '/srv/stars/wine')
+
+    def test_socket_path(self):
+        prefix = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, prefix)
+        st = os.stat(prefix)
+
+        server = processing.WineServer(prefix)
+        self.assertEqual(
+            server.socket_path(),
+            '/tmp/.wine-{0}/server-{1:x}-{2:x}/socket'.format(
+                os.getuid(), st.st_dev, st.st_ino))
+        self.assertIsNone(
+            processing.WineServer(prefix + '/missing').socket_path())
+
+    def test_is_alive(self):
+        path = os.path.join(tempfile.mkdtemp(), 'socket')
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        server = processing.WineServer()
+
+        with patch.object(server, 'socket_path', return_value=path):
+            self.assertFalse(server.is_alive())
+
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+            self.addCleanup(os.remove, path)
+            listener.listen(1)
+            self.assertTrue(server.is_alive())
+
+            # A socket left behind by a dead server.
+            listener.close()
+            self.assertFalse(server.is_alive())
+
+    @patch('starsweb.processing.subprocess.call')
+    def test_ensure_starts_once(self, mock_call):
+        server = processing.WineServer('/srv/stars/wine', linger=60)
+        with patch.object(server, 'is_alive', side_effect=[False, True]):
+            server.ensure()
+            server.ensure()
+
+        self.assertEqual(mock_call.call_args_list, [
+            call(['wineserver', '-p60'], env=server.env),
+            call(['wine', 'wineboot', '--init'], env=server.env),
+        ])
+        self.assertIsNotNone(server.boot_time)
+
+    @patch('starsweb.processing.subprocess.call')
+    def test_ensure_uses_running_server(self, mock_call):
+        # Another worker's server for the same prefix.
+        server = processing.WineServer('/srv/stars/wine')
+        with patch.object(server, 'is_alive', return_value=True):
+            server.ensure()
+
+        self.assertFalse(mock_call.called)
+        self.assertIsNone(server.record_run())
+        self.assertEqual(server.runs, 1)
+
+    @patch('starsweb.processing.subprocess.call')
+    def test_ensure_restarts_dead_server(self, mock_call):
+        server = processing.WineServer()
+        with patch.object(server, 'is_alive', side_effect=[False, False]):
+            server.ensure()
+            server.ensure()
+
+        self.assertEqual(mock_call.call_count, 4)
+
+    def test_record_run(self):
+        server = processing.WineServer()
+        server.boot_time = 2.5
+
+        self.assertEqual(server.record_run(), 2.5)
+        server.record_run()
+
+        self.assertEqual(server.runs, 2)
+        self.assertEqual(server.saved, 5.0)
+
+    @override_settings(STARSWEB_WINE_PERSISTENT=True,
+                       STARSWEB_WINEPREFIX='/srv/stars/wine')
+    @patch('starsweb.processing.WineServer.start')
+    @patch('starsweb.processing.WineServer.is_alive', return_value=False)
+    def test_execute_uses_warm_server(self, mock_alive, mock_start):
+        def se_start():
+            server.boot_time = 1.0
+
+        server = processing.wineserver()
+        mock_start.side_effect = se_start
+
+        with patch('starsweb.processing.Supervisor') as mock_supervisor:
+            mock_supervisor.return_value.run.return_value = RESULT
+            result = processing.execute(['wine'])
+
+        kwargs = mock_supervisor.call_args[1]
+        self.assertEqual(kwargs['env']['WINEPREFIX'], '/srv/stars/wine')
+        self.assertTrue(kwargs['sweep'])
+        self.assertEqual(server.runs, 1)
+        self.assertEqual(result.startup_saved, 1.0)
+
+
+class SupervisorTestCase(TestCase):
+    def test_captures_output(self):
+        supervisor = processing.Supervisor(
+            ['sh', '-c', 'echo out; echo err >&2; exit 3'], timeout=10)
+        result = supervisor.run()
+
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.stdout, 'out\n')
+        self.assertEqual(result.stderr, 'err\n')
+        self.assertFalse(result.timed_out)
+        self.assertFalse(result.killed)
+        self.assertFalse(result.orphaned)
+        self.assertGreaterEqual(result.cpu_time, 0)
+        self.assertGreater(result.max_rss, 0)
+        self.assertIsNone(result.startup_saved)
+
+    def test_own_session(self):
+        supervisor = processing.Supervisor(
+            [sys.executable, '-c',
+             'import os; print(os.getsid(0) == os.getpid())'],
+            timeout=10)
+        result = supervisor.run()
+
+        self.assertEqual(result.stdout.strip(), 'True')
+
+    def test_terminate_on_timeout(self):
+        supervisor = processing.Supervisor(['sleep', '10'], timeout=0.1)
+        result = supervisor.run()
+
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.killed)
+        self.assertEqual(result.returncode, -signal.SIGTERM)
+        self.assertLess(result.elapsed, 5)
+
+    def test_kill_escalation(self):
+        supervisor = processing.Supervisor(
+            ['sh', '-c', 'trap "" TERM; sleep 10'], timeout=0.1, grace=0.1)
+        result = supervisor.run()
+
+        self.assertTrue(result.timed_out)
+        self.assertTrue(result.killed)
+        self.assertEqual(result.returncode, -signal.SIGKILL)
+        self.assertLess(result.elapsed, 5)
+
+    def test_sweep_orphans(self):
+        supervisor = processing.Supervisor(
+            ['sh', '-c', 'sleep 10 & exit 0'], timeout=10, sweep=True)
+        result = supervisor.run()
+
+        self.assertEqual(result.returncode, 0)
+        self.assertFalse(result.timed_out)
+        self.assertTrue(result.orphaned)
+
+    @patch('starsweb.processing.Supervisor.run')
+    def test_execute_raises_on_timeout(self, mock_run):
+        mock_run.return_value = RESULT._replace(timed_out=True)
+
+        with self.assertRaises(processing.ProcessingError) as cm:
+            processing.execute(['wine'])
+
+        self.assertTrue(cm.exception.result.timed_out)
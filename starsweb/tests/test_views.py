@@ -1,22 +1,108 @@
 from __future__ import absolute_import
 
+import gzip
+import io
+import json
 import os
+import zipfile
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.files import File
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.html import escape
 
-from six.moves import zip
+from mock import patch
+from six.moves import range, zip
 
-from .. import models
+from .. import caching, downloads, models, scores, signals, zipstream
 
 PATH = os.path.dirname(__file__)
 
 
+class GameListViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='password')
+        self.list_url = reverse('game_list')
+
+    def create_game(self, n, years=0):
+        game = models.Game.objects.create(
+            name="Game {0}".format(n), slug="game-{0}".format(n),
+            host=self.user)
+        for year in range(years):
+            game.turns.create(year=2400 + year)
+        return game
+
+    def test_current_turn(self):
+        self.create_game(1)
+        self.create_game(2, years=3)
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "<td>2402</td>")
+        self.assertContains(response, "<td>2400</td>")
+
+        games = list(response.context['game_list'])
+        self.assertEqual([g.name for g in games], ["Game 2", "Game 1"])
+
+    def test_constant_queries(self):
+        self.create_game(1, years=2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.list_url)
+
+        for n in range(2, 6):
+            self.create_game(n, years=n)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.list_url)
+
+        self.assertEqual(len(response.context['game_list']), 5)
+        self.assertEqual(len(many), len(few))
+
+    def test_keyset_pages(self):
+        for n in range(30):
+            self.create_game(n, years=n % 3)
+
+        response = self.client.get(self.list_url)
+        first = list(response.context['game_list'])
+        page = response.context['page_obj']
+        self.assertEqual(len(first), 25)
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+        self.assertContains(response, "after=" + page.next_cursor())
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.list_url,
+                                       {'after': page.next_cursor()})
+        second = list(response.context['game_list'])
+        page = response.context['page_obj']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+        self.assertLessEqual(len(queries), 2)
+
+        # Games with turns come first, most recently generated first.
+        games = first + second
+        self.assertEqual(len(set(g.pk for g in games)), 30)
+        generated = [g.last_generated for g in games if g.last_generated]
+        self.assertEqual(generated, sorted(generated, reverse=True))
+        self.assertEqual([g.last_generated is None for g in games],
+                         [False] * 20 + [True] * 10)
+
+        response = self.client.get(self.list_url,
+                                   {'before': page.previous_cursor()})
+        self.assertEqual(list(response.context['game_list']), first)
+
+    def test_bad_cursor(self):
+        response = self.client.get(self.list_url, {'after': 'foobar'})
+        self.assertEqual(response.status_code, 404)
+
+
 class GameDetailViewTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='admin', password='password')
@@ -92,12 +178,9 @@ class GameDetailViewTestCase(TestCase):
         self.game.state = 'A'
         self.game.save()
         turn = self.game.turns.create(year=2401)
-        turn.scores.create(race=self.race1, section=models.Score.SCORE,
-                           value=247)
-        turn.scores.create(race=self.race2, section=models.Score.SCORE,
-                           value=430)
-        turn.scores.create(race=self.race3, section=models.Score.SCORE,
-                           value=576)
+        turn.race_scores.create(race=self.race1, score=247)
+        turn.race_scores.create(race=self.race2, score=430)
+        turn.race_scores.create(race=self.race3, score=576)
 
         response = self.client.get(self.detail_url)
         self.assertContains(response, "Year 2401")
@@ -123,12 +206,9 @@ class GameDetailViewTestCase(TestCase):
         self.game.state = 'A'
         self.game.save()
         turn = self.game.turns.create(year=2401)
-        turn.scores.create(race=self.race1, section=models.Score.SCORE,
-                           value=5097)
-        turn.scores.create(race=self.race2, section=models.Score.SCORE,
-                           value=6702)
-        turn.scores.create(race=self.race3, section=models.Score.SCORE,
-                           value=0)
+        turn.race_scores.create(race=self.race1, score=5097)
+        turn.race_scores.create(race=self.race2, score=6702)
+        turn.race_scores.create(race=self.race3, score=0)
 
         response = self.client.get(self.detail_url)
         self.assertContains(response, "Year 2401")
@@ -154,20 +234,14 @@ class GameDetailViewTestCase(TestCase):
         self.game.state = 'A'
         self.game.save()
         turn = self.game.turns.create(year=2401)
-        turn.scores.create(race=self.race1, section=models.Score.SCORE,
-                           value=247)
-        turn.scores.create(race=self.race2, section=models.Score.SCORE,
-                           value=430)
-        turn.scores.create(race=self.race3, section=models.Score.SCORE,
-                           value=576)
+        turn.race_scores.create(race=self.race1, score=247)
+        turn.race_scores.create(race=self.race2, score=430)
+        turn.race_scores.create(race=self.race3, score=576)
 
         turn = self.game.turns.create(year=2402)
-        turn.scores.create(race=self.race1, section=models.Score.SCORE,
-                           value=5097)
-        turn.scores.create(race=self.race2, section=models.Score.SCORE,
-                           value=6702)
-        turn.scores.create(race=self.race3, section=models.Score.SCORE,
-                           value=3592)
+        turn.race_scores.create(race=self.race1, score=5097)
+        turn.race_scores.create(race=self.race2, score=6702)
+        turn.race_scores.create(race=self.race3, score=3592)
 
         response = self.client.get(self.detail_url)
         self.assertContains(response, "Year 2402")
@@ -186,6 +260,451 @@ class GameDetailViewTestCase(TestCase):
         self.assertNotContains(response, "<td>430</td>")
         self.assertNotContains(response, "<td>247</td>")
 
+    def add_race(self, n):
+        race = models.Race.objects.create(
+            game=self.game, name='Race{0}'.format(n),
+            plural_name='Race{0}s'.format(n), slug='race{0}'.format(n))
+        user = User.objects.create_user(username='player{0}'.format(n))
+        race.ambassadors.create(user=user, name="Player {0}".format(n))
+        race.homepage = models.RacePage.objects.create(
+            race=race, title="Race {0} Home".format(n), body="Hello.")
+        race.save()
+        return race
+
+    def test_query_budget(self):
+        self.game.turns.create(year=2401)
+        self.race1.ambassadors.create(user=self.user, name="KonTiki")
+
+        # Including the game's modification stamp, for conditional GET.
+        with self.assertNumQueries(7):
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>KonTiki</td>")
+
+        for n in range(13):
+            self.add_race(n)
+
+        with self.assertNumQueries(7):
+            response = self.client.get(self.detail_url)
+        self.assertEqual(len(response.context['races']), 16)
+        self.assertContains(response, "<td>Player 12</td>")
+        self.assertContains(response, reverse(
+            'race_homepage', kwargs={'game_slug': self.game.slug,
+                                     'race_slug': 'race12'}))
+
+
+class ScoreDataViewTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='password')
+        self.game = models.Game.objects.create(
+            name="Total War in Ulfland", slug="total-war-in-ulfland",
+            host=self.user, state='A')
+        self.race1 = models.Race.objects.create(
+            game=self.game, name='Gestalti', plural_name='Gestalti',
+            slug='gestalti')
+        self.race2 = models.Race.objects.create(
+            game=self.game, name='Phizz', plural_name='Phizz', slug='phizz')
+
+        for year in range(2400, 2405):
+            turn = self.game.turns.create(year=year)
+            for race in (self.race1, self.race2):
+                turn.race_scores.create(race=race,
+                                        score=(year - 2399) * race.pk,
+                                        planets=year - 2399)
+
+        self.data_url = reverse('score_data',
+                                kwargs={'game_slug': self.game.slug})
+
+    def test_all_scores(self):
+        response = self.client.get(self.data_url)
+        self.assertEqual(response.status_code, 200)
+
+        data = response.json()
+        self.assertEqual(data['year_min'], 2400)
+        self.assertEqual(data['year_max'], 2404)
+        self.assertEqual(data['current_year'], 2404)
+        self.assertEqual(sorted(data['scores']), ['planets', 'score'])
+        self.assertEqual(data['scores']['score']['Phizz'],
+                         [2, 4, 6, 8, 10])
+        self.assertEqual(data['scores']['planets']['Gestalti'],
+                         [1, 2, 3, 4, 5])
+
+    def test_filters(self):
+        response = self.client.get(self.data_url, {
+            'section': 'planets', 'races[]': ['Phizz'],
+            'from_year': 2401, 'to_year': 2402})
+
+        data = response.json()
+        self.assertEqual((data['year_min'], data['year_max']), (2401, 2402))
+        self.assertEqual(data['scores'], {'planets': {'Phizz': [2, 3]}})
+
+    def test_since_year(self):
+        response = self.client.get(self.data_url, {
+            'section': ['score', 'planets'], 'since_year': 2403})
+
+        data = response.json()
+        self.assertEqual((data['year_min'], data['year_max']), (2404, 2404))
+        self.assertEqual(data['scores']['score'], {'Gestalti': [5],
+                                                   'Phizz': [10]})
+
+        response = self.client.get(self.data_url, {'since_year': 2404})
+        data = response.json()
+        self.assertIsNone(data['year_min'])
+        self.assertEqual(data['scores'], {})
+        self.assertEqual(data['current_year'], 2404)
+
+    def test_downsampled(self):
+        for year in range(2405, 2500):
+            turn = self.game.turns.create(year=year)
+            turn.race_scores.create(race=self.race1, score=year % 7)
+
+        response = self.client.get(self.data_url, {
+            'section': 'score', 'points': 20})
+        data = response.json()
+        series = data['scores']['score']['Gestalti']
+        self.assertEqual(len(series), 20)
+        self.assertEqual(series[0], [2400, 1])
+        self.assertEqual(series[-1], [2499, 2499 % 7])
+
+        # Short series, and years with no score, come back as they are.
+        self.assertEqual(data['scores']['score']['Phizz'],
+                         [[2400, 2], [2401, 4], [2402, 6], [2403, 8],
+                          [2404, 10]])
+
+    def test_overview_cached(self):
+        query = {'section': 'score', 'to_year': 2404, 'points': 100}
+        data = self.client.get(self.data_url, query).json()
+
+        with patch('starsweb.scores.downsample') as downsample:
+            again = self.client.get(self.data_url, query).json()
+        self.assertFalse(downsample.called)
+        self.assertEqual(again, data)
+
+        # A new turn brings a new version of the game.
+        self.game.turns.create(year=2405)
+        self.assertEqual(
+            self.client.get(self.data_url, query).json()['current_year'],
+            2405)
+
+    def test_artefact(self):
+        call_command('rebuild_score_artefacts', self.game.slug)
+        storage = scores.artefact_storage()
+        name = scores.artefact_name(self.game, 2404)
+        self.addCleanup(storage.delete, name)
+        self.addCleanup(storage.delete, name + '.gz')
+
+        # Served from the artefact, without the score table.
+        models.RaceScore.objects.all().delete()
+
+        response = self.client.get(self.data_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        data = json.loads(
+            b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(data['current_year'], 2404)
+        self.assertEqual(data['scores']['score']['Phizz'],
+                         [2, 4, 6, 8, 10])
+
+        response = self.client.get(self.data_url,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = io.BytesIO(b''.join(response.streaming_content))
+        with gzip.GzipFile(fileobj=content) as f:
+            self.assertEqual(json.loads(f.read().decode('utf-8')), data)
+
+        response = self.client.get(self.data_url, {
+            'section': 'planets', 'races[]': ['Phizz'],
+            'from_year': 2401, 'to_year': 2402})
+        data = response.json()
+        self.assertEqual((data['year_min'], data['year_max']), (2401, 2402))
+        self.assertEqual(data['scores'], {'planets': {'Phizz': [2, 3]}})
+
+    def test_bad_parameters(self):
+        response = self.client.get(self.data_url, {'section': 'foobar'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(self.data_url, {'since_year': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(self.data_url, {'points': 2})
+        self.assertEqual(response.status_code, 400)
+
+    def test_does_not_exist(self):
+        response = self.client.get(reverse(
+            'score_data', kwargs={'game_slug': '500-years-after'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_graph_page(self):
+        response = self.client.get(reverse(
+            'score_graph', kwargs={'slug': self.game.slug}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.data_url)
+        self.assertEqual(response.context['year_min'], 2400)
+        self.assertEqual(response.context['year_max'], 2404)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='password')
+        self.game = models.Game.objects.create(
+            name="Total War in Ulfland", slug="total-war-in-ulfland",
+            host=self.user, state='A')
+        self.race = models.Race.objects.create(
+            game=self.game, name='Gestalti', plural_name='Gestalti',
+            slug='gestalti')
+        self.race.homepage = self.race.racepages.create(
+            title="Home", body="We are the Gestalti.")
+        self.race.save()
+
+        self.detail_url = reverse('game_detail',
+                                  kwargs={'slug': self.game.slug})
+        self.homepage_url = reverse('race_homepage', kwargs={
+            'game_slug': self.game.slug, 'race_slug': self.race.slug})
+
+    def assertNotModified(self, url, response):
+        # The stamp, or nothing at all if the page cache has the page.
+        with CaptureQueriesContext(connection) as ctx:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertLessEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def test_game_pages(self):
+        for url in (self.detail_url, self.homepage_url,
+                    reverse('score_graph', kwargs={'slug': self.game.slug})):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.has_header('Last-Modified'))
+            self.assertIn('Cookie', response['Vary'])
+            self.assertNotModified(url, response)
+
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_race_page(self):
+        page = self.race.racepages.create(title="Government",
+                                          body="Who knows?")
+        url = reverse('race_page', kwargs={
+            'game_slug': self.game.slug, 'race_slug': self.race.slug,
+            'slug': page.slug})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        self.race.save()
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], response['ETag'])
+
+    def test_changes(self):
+        response = self.client.get(self.detail_url)
+        etag = response['ETag']
+
+        changes = [
+            lambda: self.game.turns.create(year=2400),
+            lambda: self.race.save(),
+            lambda: self.race.homepage.save(),
+            lambda: self.race.ambassadors.create(user=self.user,
+                                                 name="KonTiki"),
+            lambda: self.race.ambassadors.all().delete(),
+            lambda: self.game.save(),
+        ]
+        for change in changes:
+            change()
+            response = self.client.get(self.detail_url,
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_per_user(self):
+        response = self.client.get(self.detail_url)
+        self.client.login(username='admin', password='password')
+
+        again = self.client.get(self.detail_url,
+                                HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], response['ETag'])
+
+    def test_game_list(self):
+        url = reverse('game_list')
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        models.Game.objects.create(name="Foobar", slug="foobar",
+                                   host=self.user)
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertContains(again, "Foobar")
+
+        models.Game.objects.filter(slug="foobar").delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=again['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_game(self):
+        url = reverse('game_detail', kwargs={'slug': '500-years-after'})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.user = User.objects.create_user(username='admin', password='password')
+        self.game = models.Game.objects.create(
+            name="Total War in Ulfland", slug="total-war-in-ulfland",
+            host=self.user, state='A')
+        self.race = models.Race.objects.create(
+            game=self.game, name='Gestalti', plural_name='Gestalti',
+            slug='gestalti')
+
+        self.detail_url = reverse('game_detail',
+                                  kwargs={'slug': self.game.slug})
+
+    def test_anonymous(self):
+        # The first visit gets a CSRF cookie, and pages are cached per
+        # cookie.
+        self.client.get(self.detail_url)
+        self.assertIn(settings.CSRF_COOKIE_NAME, self.client.cookies)
+
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "The Gestalti")
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.detail_url)
+        self.assertEqual(cached.content, response.content)
+
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.detail_url,
+                                     HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        self.race.ambassadors.create(user=self.user, name="KonTiki")
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>KonTiki</td>")
+
+    def test_race_page(self):
+        page = self.race.racepages.create(title="Government",
+                                          body="Who knows?")
+        url = reverse('race_page', kwargs={
+            'game_slug': self.game.slug, 'race_slug': self.race.slug,
+            'slug': page.slug})
+        self.client.get(url)
+        self.assertContains(self.client.get(url), "Who knows?")
+
+        # Edited in place, since saving it would give it a new slug.
+        models.RacePage.objects.filter(pk=page.pk).update(
+            body="A hive mind.", body_html="<p>A hive mind.</p>")
+        self.race.save()
+        self.assertContains(self.client.get(url), "A hive mind.")
+
+    def test_authenticated(self):
+        self.client.login(username='admin', password='password')
+        self.race.ambassadors.create(user=self.user, name="KonTiki")
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>KonTiki</td>")
+
+        # Not the whole page, but the race table comes from the cache.
+        with self.assertNumQueries(4):
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>KonTiki</td>")
+
+        self.game.turns.create(year=2400).race_scores.create(
+            race=self.race, score=247)
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>247</td>")
+
+    def test_game_list(self):
+        url = reverse('game_list')
+        self.client.get(url)
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        models.Game.objects.create(name="Foobar", slug="foobar",
+                                   host=self.user)
+        self.assertContains(self.client.get(url), "Foobar")
+
+    def test_new_csrf_token(self):
+        response = self.client.get(self.detail_url)
+        self.assertContains(response, "csrfmiddlewaretoken")
+
+        # Someone else, without the cookie the token was made for.
+        self.client.cookies.clear()
+        with self.assertNumQueries(2):
+            self.client.get(self.detail_url)
+
+    def test_warm_game(self):
+        turn = self.game.turns.create(year=2400)
+        turn.race_scores.create(race=self.race, score=247)
+        scores.write_artefact(self.game, 2400)
+        name = scores.artefact_name(self.game, 2400)
+        self.addCleanup(scores.artefact_storage().delete, name)
+        self.addCleanup(scores.artefact_storage().delete, name + '.gz')
+
+        caching.warm_game(self.game)
+
+        # The race table is already built for the first visitor.
+        self.client.login(username='admin', password='password')
+        with self.assertNumQueries(4):
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>247</td>")
+
+        # As are the scores.
+        with patch('starsweb.scores.read_artefact') as read_artefact:
+            response = self.client.get(
+                reverse('score_data', kwargs={'game_slug': self.game.slug}),
+                {'section': 'score', 'points': 100})
+        self.assertFalse(read_artefact.called)
+        self.assertEqual(response.json()['scores'],
+                         {'score': {'Gestalti': [[2400, 247]]}})
+
+    def test_warm_game_anonymous(self):
+        self.game.turns.create(year=2400).race_scores.create(
+            race=self.race, score=247)
+        # The first visit only gets the CSRF cookie.
+        self.client.get(reverse('game_list'))
+
+        caching.warm_game(self.game)
+
+        # No whole page was stored for lack of a CSRF cookie to key it
+        # on; the race table is served from the cache, though.
+        for url in (self.detail_url,
+                    reverse('score_graph', kwargs={'slug': self.game.slug})):
+            request = caching._warm_request(url, {})
+            self.assertIsNone(cache.get(caching._page_key(request)))
+        with self.assertNumQueries(2):
+            response = self.client.get(self.detail_url)
+        self.assertContains(response, "<td>247</td>")
+
+    @patch('starsweb.signals.transaction.on_commit', lambda func: func())
+    def test_turn_generated(self):
+        turn = self.game.turns.create(year=2400)
+        with patch('starsweb.caching.warm_game') as warm_game:
+            signals.turn_generated.send(sender=models.Game,
+                                        instance=self.game, turn=turn)
+        warm_game.assert_called_once_with(self.game)
+
+        # A failed warm-up doesn't fail the generation.
+        with patch('starsweb.caching.warm_game', side_effect=ValueError), \
+                patch('starsweb.signals.logger') as logger:
+            signals.turn_generated.send(sender=models.Game,
+                                        instance=self.game, turn=turn)
+        self.assertTrue(logger.exception.called)
+
+    def test_renamed(self):
+        self.client.get(self.detail_url)
+        self.client.get(self.detail_url)
+
+        self.game.slug = 'total-war'
+        self.game.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 404)
+
 
 class GameCreateViewTestCase(TestCase):
     def setUp(self):
@@ -339,6 +858,37 @@ class GameMapDownloadTestCase(TestCase):
                          'attachment; filename="total-wa.xy"')
         self.assertEqual(response['Content-length'], '3864')
 
+    def test_compressed(self):
+        with self.settings(STARSWEB_COMPRESSION='zlib'):
+            self.game.mapfile = models.StarsFile.from_file(
+                self.game.mapfile.file)
+        self.game.save()
+
+        response = self.client.get(self.download_url,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'deflate')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa.xy"')
+        self.assertLess(int(response['Content-length']), 3864)
+
+    def test_compressed_not_accepted(self):
+        with self.settings(STARSWEB_COMPRESSION='zlib'):
+            self.game.mapfile = models.StarsFile.from_file(
+                self.game.mapfile.file)
+        self.game.save()
+
+        response = self.client.get(self.download_url,
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate;q=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa.xy"')
+        self.assertEqual(response['Content-length'], '3864')
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            self.assertEqual(response.content, f.read())
+
     def test_no_mapfile_attached(self):
         self.game.mapfile = None
         self.game.save()
@@ -2538,6 +3088,19 @@ class StateFileDownloadTestCase(TestCase):
         response = self.client.get(self.download_url)
         self.assertEqual(response.status_code, 404)
 
+    def test_only_current_turn(self):
+        self.game.turns.create(year=2401)
+
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_queries(self):
+        # The session, the user, the race with everything checked about
+        # it, and the race's turn with its file.
+        with self.assertNumQueries(4):
+            response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+
 
 class OrderFileDownloadTestCase(TestCase):
     def setUp(self):
@@ -2952,6 +3515,424 @@ class HistoryFileDownloadTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
+class SignedFileDownloadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin',
+                                             password='password')
+        self.client.login(username='admin', password='password')
+
+        self.game = models.Game(
+            name="Total War in Ulfland",
+            slug="total-war-in-ulfland",
+            host=self.user, state='A',
+            description="This *game* is foobared.",
+        )
+        self.game.save()
+
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            self.game.mapfile = models.StarsFile.from_file(File(f))
+        self.game.save()
+
+        self.race = models.Race(game=self.game,
+                                name='Gestalti',
+                                plural_name='Gestalti',
+                                slug='gestalti',
+                                player_number=0)
+        self.race.save()
+        self.ambassador = models.Ambassador(race=self.race,
+                                            user=self.user,
+                                            name="KonTiki")
+        self.ambassador.save()
+
+        self.starsfile = models.StarsFile(
+            type='m', file=SimpleUploadedFile(".m", b"turn 2400"))
+        self.starsfile.save()
+
+        self.turn = self.game.turns.create(year=2400)
+        self.raceturn = self.turn.raceturns.create(race=self.race,
+                                                   mfile=self.starsfile)
+
+        self.dashboard_url = reverse(
+            'race_dashboard', kwargs={'game_slug': 'total-war-in-ulfland',
+                                      'race_slug': 'gestalti'})
+
+    def tearDown(self):
+        for starsfile in models.StarsFile.objects.all():
+            starsfile.file.delete()
+
+    def links(self):
+        response = self.client.get(self.dashboard_url)
+        self.assertEqual(response.status_code, 200)
+        return dict((filename, signed_url) for filename, url, signed_url
+                    in response.context['download_links'])
+
+    def test_dashboard(self):
+        links = self.links()
+        self.assertEqual(sorted(links), ['total-wa.m1', 'total-wa.xy'])
+        response = self.client.get(self.dashboard_url)
+        self.assertContains(response, links['total-wa.m1'])
+
+        # Stable for the turn.
+        self.assertEqual(self.links(), links)
+
+    def test_download(self):
+        url = self.links()['total-wa.m1']
+        self.client.logout()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa.m1"')
+        self.assertEqual(response['Content-length'], '9')
+
+    def test_compressed_not_accepted(self):
+        with self.settings(STARSWEB_COMPRESSION='zlib'):
+            self.game.mapfile = models.StarsFile.from_file(
+                self.game.mapfile.file)
+        self.game.save()
+
+        response = self.client.get(self.links()['total-wa.xy'],
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            self.assertEqual(response.content, f.read())
+
+    def test_tampered(self):
+        url = self.links()['total-wa.m1']
+        token = url.split('/')[-2]
+        url = url.replace(token, token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_expired(self):
+        token = downloads.make_token(self.starsfile, 'total-wa.m1', now=0)
+        response = self.client.get(
+            reverse('signed_download', kwargs={'token': token}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_expiry(self):
+        with self.settings(STARSWEB_DOWNLOAD_LINK_MAX_AGE=100):
+            self.assertEqual(downloads.expiry(now=50), 200)
+            self.assertEqual(downloads.expiry(now=99), 200)
+            self.assertEqual(downloads.expiry(now=100), 300)
+
+
+class StarsFileDownloadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin',
+                                             password='password')
+        self.client.login(username='admin', password='password')
+
+        self.game = models.Game(
+            name="Total War in Ulfland",
+            slug="total-war-in-ulfland",
+            host=self.user, state='A',
+            description="This *game* is foobared.",
+        )
+        self.game.save()
+
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            self.game.mapfile = models.StarsFile.from_file(File(f))
+        self.game.save()
+
+        self.race = models.Race(game=self.game,
+                                name='Gestalti',
+                                plural_name='Gestalti',
+                                slug='gestalti',
+                                player_number=0)
+        self.race.save()
+        self.ambassador = models.Ambassador(race=self.race,
+                                            user=self.user,
+                                            name="KonTiki")
+        self.ambassador.save()
+
+        self.starsfile = models.StarsFile(
+            type='m', file=SimpleUploadedFile(".m", b"turn 2400"))
+        self.starsfile.save()
+
+        self.turn = self.game.turns.create(year=2400)
+        self.turn.raceturns.create(race=self.race, mfile=self.starsfile)
+
+        self.download_url = self.starsfile.get_download_url('total-wa.m1')
+
+    def tearDown(self):
+        for starsfile in models.StarsFile.objects.all():
+            starsfile.file.delete()
+
+    def test_dashboard(self):
+        response = self.client.get(reverse(
+            'race_dashboard', kwargs={'game_slug': 'total-war-in-ulfland',
+                                      'race_slug': 'gestalti'}))
+        links = dict((filename, url) for filename, url, signed_url
+                     in response.context['download_links'])
+        self.assertEqual(links['total-wa.m1'], self.download_url)
+        self.assertContains(response, self.download_url)
+
+        response = self.client.get(links['total-wa.xy'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_dashboard_racefile(self):
+        self.race.racefile = models.StarsFile.objects.create(
+            type='r', file=SimpleUploadedFile(".r", b"gestalti"))
+        self.race.save()
+
+        response = self.client.get(reverse(
+            'race_dashboard', kwargs={'game_slug': 'total-war-in-ulfland',
+                                      'race_slug': 'gestalti'}))
+        url = self.race.racefile.get_download_url('gestalti.r1')
+        self.assertEqual(response.context['racefile_url'], url)
+        self.assertContains(response, url)
+        response = self.client.get(url)
+        self.assertEqual(b''.join(response.streaming_content), b"gestalti")
+
+    def test_success(self):
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa.m1"')
+        self.assertEqual(response['Content-length'], '9')
+        self.assertEqual(response['ETag'],
+                         '"{0}"'.format(self.starsfile.digest))
+        self.assertEqual(response['Cache-Control'],
+                         'private, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+
+    def test_map_is_public(self):
+        self.client.logout()
+        response = self.client.get(
+            self.game.mapfile.get_download_url('total-wa.xy'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-length'], '3864')
+        self.assertEqual(response['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+
+    def test_anonymous(self):
+        self.client.logout()
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_unauthorized(self):
+        User.objects.create_user(username='jrb', password='password')
+        self.client.login(username='jrb', password='password')
+
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.download_url)['ETag']
+        response = self.client.get(self.download_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_range(self):
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'turn')
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/9')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'2400')
+
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=5-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'2400')
+        self.assertEqual(response['Content-Range'], 'bytes 5-8/9')
+
+    def test_range_not_satisfiable(self):
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=9-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */9')
+
+    def test_multiple_ranges(self):
+        response = self.client.get(self.download_url,
+                                   HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-length'], '9')
+
+    def test_if_range(self):
+        etag = '"{0}"'.format(self.starsfile.digest)
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=0-3',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        response = self.client.get(self.download_url, HTTP_RANGE='bytes=0-3',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-length'], '9')
+
+    def test_compressed(self):
+        with self.settings(STARSWEB_COMPRESSION='zlib'):
+            self.game.mapfile = models.StarsFile.from_file(
+                self.game.mapfile.file)
+        self.game.save()
+        url = self.game.mapfile.get_download_url('total-wa.xy')
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            content = f.read()
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'deflate')
+        self.assertEqual(response['ETag'],
+                         '"{0}-deflate"'.format(self.game.mapfile.digest))
+        self.assertLess(int(response['Content-length']), 3864)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['ETag'],
+                         '"{0}"'.format(self.game.mapfile.digest))
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/3864')
+        self.assertEqual(response.content, content[100:200])
+
+
+class TurnBundleDownloadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin',
+                                             password='password')
+        self.client.login(username='admin', password='password')
+
+        self.game = models.Game(
+            name="Total War in Ulfland",
+            slug="total-war-in-ulfland",
+            host=self.user, state='A',
+            description="This *game* is foobared.",
+        )
+        self.game.save()
+
+        with open(os.path.join(PATH, 'files', 'ulf_war.xy'), 'rb') as f:
+            self.xy = f.read()
+        with self.settings(STARSWEB_COMPRESSION='zlib'):
+            self.game.mapfile = models.StarsFile.from_data(self.xy)
+        self.game.save()
+
+        self.race = models.Race(game=self.game,
+                                name='Gestalti',
+                                plural_name='Gestalti',
+                                slug='gestalti',
+                                player_number=0)
+        self.race.save()
+        self.ambassador = models.Ambassador(race=self.race,
+                                            user=self.user,
+                                            name="KonTiki")
+        self.ambassador.save()
+
+        mfile = models.StarsFile(
+            type='m', file=SimpleUploadedFile(".m", b"turn 2400"))
+        mfile.save()
+        hfile = models.StarsFile(
+            type='h', file=SimpleUploadedFile(".h", b"history"))
+        hfile.save()
+
+        self.turn = self.game.turns.create(year=2400)
+        self.raceturn = self.turn.raceturns.create(
+            race=self.race, mfile=mfile, hfile=hfile)
+
+        self.download_url = reverse(
+            'bundle_download', kwargs={'game_slug': 'total-war-in-ulfland',
+                                       'race_slug': 'gestalti'})
+
+    def tearDown(self):
+        for starsfile in models.StarsFile.objects.all():
+            starsfile.file.delete()
+
+    def test_authorized(self):
+        # The session, the user, the race and the race's turn; the files
+        # are read as the response is sent.
+        with self.assertNumQueries(4):
+            response = self.client.get(self.download_url)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa-2400-1.zip"')
+
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(),
+                         ['total-wa.m1', 'total-wa.xy', 'total-wa.h1'])
+        self.assertEqual(archive.read('total-wa.m1'), b"turn 2400")
+        self.assertEqual(archive.read('total-wa.xy'), self.xy)
+        self.assertEqual(archive.read('total-wa.h1'), b"history")
+
+    def test_packet(self):
+        self.raceturn.packet = self.game._make_packet(
+            0, b"turn 2400", self.xy)
+        self.raceturn.hfile = None
+        self.raceturn.save()
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="total-wa-2400-1.zip"')
+
+        archive = zipfile.ZipFile(io.BytesIO(
+            b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['total-wa.m1', 'total-wa.xy'])
+        self.assertEqual(archive.read('total-wa.m1'), b"turn 2400")
+
+    def test_packet_out_of_date(self):
+        # Once the history file is uploaded, the packet lacks it.
+        self.raceturn.packet = self.game._make_packet(
+            0, b"turn 2400", self.xy)
+        self.raceturn.save()
+
+        response = self.client.get(self.download_url)
+        archive = zipfile.ZipFile(io.BytesIO(
+            b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(),
+                         ['total-wa.m1', 'total-wa.xy', 'total-wa.h1'])
+
+    def test_ambassador_no_longer_active(self):
+        self.ambassador.active = False
+        self.ambassador.save()
+
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_unauthorized(self):
+        User.objects.create_user(username='jrb', password='password')
+        self.client.login(username='jrb', password='password')
+
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_anonymous(self):
+        self.client.logout()
+
+        response = self.client.get(self.download_url)
+        self.assertRedirects(response,
+                             "{0}?next={1}".format(settings.LOGIN_URL,
+                                                   self.download_url))
+
+    def test_no_turns_have_been_generated(self):
+        self.raceturn.delete()
+
+        response = self.client.get(self.download_url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_zip_stream(self):
+        content = b''.join(zipstream.zip_stream(
+            [(u'caf\xe9.txt', iter([b'abc' * 100, b'def']),
+              (2400, 1, 1, 0, 0, 0))],
+            compress_type=zipfile.ZIP_DEFLATED))
+
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertIsNone(archive.testzip())
+        info = archive.getinfo(u'caf\xe9.txt')
+        self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(info.compress_size, info.file_size)
+        self.assertEqual(archive.read(info), b'abc' * 100 + b'def')
+
+
 class HistoryFileUploadTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='admin', password='password')
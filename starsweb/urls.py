@@ -22,6 +22,10 @@ urlpatterns = [
         name='userrace_update'),
     url(r'^user/delete/(?P<pk>\d+)/$', views.UserRaceDelete.as_view(),
         name='userrace_delete'),
+    url(r'^files/sha256/(?P<digest>[0-9a-f]{64})/(?P<filename>[-\w.]+)$',
+        views.StarsFileDownload.as_view(), name='starsfile_download'),
+    url(r'^files/(?P<token>[-\w:]+)/$', views.SignedFileDownload.as_view(),
+        name='signed_download'),
     url(r'^create/$', views.GameCreateView.as_view(), name='create_game'),
     url(r'^game/$', views.GameListView.as_view(), name='game_list'),
     url(r'^game/(?P<slug>[-\w]+)/$', views.GameDetailView.as_view(),
@@ -34,6 +38,8 @@ urlpatterns = [
         name='game_mapdownload'),
     url(r'^game/(?P<slug>[-\w]+)/score/$',
         views.ScoreGraphView.as_view(), name='score_graph'),
+    url(r'^game/(?P<game_slug>[-\w]+)/score/data/$',
+        views.ScoreDataView.as_view(), name='score_data'),
     url(r'^game/(?P<game_slug>[-\w]+)/race/(?P<race_slug>[-\w]+)/pages/$',
         views.RacePageView.as_view(), {'slug': None}, name='race_homepage'),
     url(r'^game/(?P<game_slug>[-\w]+)/race/(?P<race_slug>[-\w]+)/pages/(?P<slug>[-\w]+)/$',
@@ -66,6 +72,8 @@ urlpatterns = [
         views.HistoryFileDownload.as_view(), name='history_download'),
     url(r'^game/(?P<game_slug>[-\w]+)/history/(?P<race_slug>[-\w]+)/upload/$',
         views.HistoryFileUpload.as_view(), name='history_upload'),
+    url(r'^game/(?P<game_slug>[-\w]+)/bundle/(?P<race_slug>[-\w]+)/download/$',
+        views.TurnBundleDownload.as_view(), name='bundle_download'),
 ]
 
 if 'micropress' in settings.INSTALLED_APPS:
@@ -1,32 +1,91 @@
 from __future__ import absolute_import
+import calendar
+import hashlib
 import json
+import os.path
 
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required, login_required
 from django.core.exceptions import PermissionDenied
 from django.core.files.base import ContentFile
-from django.db.models import Max
-from django.http import Http404
+from django.db.models import (Case, F, IntegerField, Max, Min, Q, Value,
+                              When)
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
+                         JsonResponse, StreamingHttpResponse)
 from django.template.defaultfilters import slugify
 from django.urls import reverse_lazy
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
 from django.views.generic import (ListView, DetailView, CreateView, UpdateView,
                                   DeleteView, TemplateView, View)
 from sendfile import sendfile
-from six.moves import range
-
-from starslib import base
+import six
 
+from . import caching
+from . import compression
+from . import conditional
+from . import downloads
 from . import models
 from . import forms
-
-
+from . import pagination
+from . import parsing
+from . import ranges
+from . import scores
+from . import zipstream
+
+
+def send_starsfile(request, starsfile, filename, mimetype=None):
+    return send_stored(request, starsfile.file.path, starsfile.compression,
+                       filename, mimetype)
+
+
+def send_stored(request, path, method, filename, mimetype=None):
+    # A blob stored in an HTTP content-coding the client accepts is sent
+    # as it is; otherwise it is decompressed on the way out.
+    if not method:
+        return sendfile(request, path, attachment=True,
+                        attachment_filename=filename, mimetype=mimetype)
+
+    if compression.accepts(request, method):
+        response = sendfile(request, path, attachment=True,
+                            attachment_filename=filename, mimetype=mimetype)
+        response['Content-Encoding'] = compression.CONTENT_ENCODINGS[method]
+    else:
+        with open(path, 'rb') as f:
+            data = compression.decompress(f.read(), method)
+        response = HttpResponse(
+            data, content_type=mimetype or 'application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+            filename)
+        response['Content-Length'] = str(len(data))
+
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+@caching.cached_game_list
+@conditional.conditional_game_list
 class GameListView(ListView):
-    queryset = models.Game.objects.prefetch_related('turns').annotate(
-        generated=Max('turns__generated')).order_by('-generated', '-created')
+    queryset = models.Game.objects.select_related('latest_turn')
+    paginate_by = 25
 
     state = None
 
+    def paginate_queryset(self, queryset, page_size):
+        # Most recently generated first, then games that have yet to
+        # generate a turn, newest first.
+        paginator = pagination.KeysetPaginator(
+            queryset, page_size, 'last_generated', ('created', 'pk'))
+        try:
+            page = paginator.page(after=self.request.GET.get('after'),
+                                  before=self.request.GET.get('before'))
+        except pagination.InvalidCursor:
+            raise Http404
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get_queryset(self):
         queryset = super(GameListView, self).get_queryset()
 
@@ -37,22 +96,32 @@ class GameListView(ListView):
         return queryset
 
 
+@caching.cached_game
+@conditional.conditional_game
 class GameDetailView(DetailView):
-    model = models.Game
-
-    def get_context_data(self, **kwargs):
-        context = {}
+    queryset = models.Game.objects.select_related('latest_turn')
 
+    def race_table(self):
         scores = {}
         turn = self.object.current_turn
         if turn:
             scores.update(
-                turn.scores.filter(section=models.Score.SCORE
-                                   ).values_list('race__plural_name', 'value'))
-        context['races'] = sorted(((race, scores.get(str(race)))
-                                   for race in self.object.races.all()),
-                                  key=lambda r_s: (r_s[1] if r_s[1] is None else -r_s[1],
-                                                      r_s[0].player_number, r_s[0].pk))
+                turn.race_scores.filter(score__isnull=False
+                                        ).values_list('race__plural_name', 'score'))
+        races = self.object.races.select_related(
+            'homepage').prefetch_related('ambassadors')
+        return sorted(((race, scores.get(str(race))) for race in races),
+                      key=lambda r_s: (r_s[1] if r_s[1] is None else -r_s[1],
+                                       r_s[0].player_number, r_s[0].pk))
+
+    def get_context_data(self, **kwargs):
+        # The race table is a cached fragment; it is only built when
+        # that misses.
+        context = {
+            'races': SimpleLazyObject(self.race_table),
+            'cache_timeout': caching.timeout(),
+            'cache_version': caching.game_version(self.object.slug),
+        }
         context.update(kwargs)
         return super(GameDetailView, self).get_context_data(**context)
 
@@ -105,14 +174,40 @@ class ParentGameMixin(object):
 
 
 class ParentRaceMixin(ParentGameMixin):
+    """Resolves a race, and what race views check about it, in one query.
+
+    The race is fetched with its game, the game's current turn and the
+    race's files joined in, and annotated with whether the requesting
+    user is one of its ambassadors, which of those is active, and the
+    pk of its RaceTurn for the current turn.  The result is memoised on
+    the view, so ``get_game``, ``get_race``, ``check_ambassador``,
+    ``get_ambassador`` and ``get_raceturn`` share that one query.
+
+    """
     context_race_name = 'race'
 
     race_slug_field = 'slug'
     pk_race_kwarg = 'race_pk'
     slug_race_kwarg = 'race_slug'
 
-    def get_race(self):
-        race_queryset = self.game.races.all()
+    _resolved_race = None
+
+    def get_race_queryset(self):
+        race_queryset = models.Race.objects.select_related(
+            'game__latest_turn', 'game__mapfile', 'homepage', 'racefile',
+            'official_racefile')
+
+        pk = self.kwargs.get(self.pk_game_kwarg, None)
+        slug = self.kwargs.get(self.slug_game_kwarg, None)
+        if pk is not None:
+            race_queryset = race_queryset.filter(game__pk=pk)
+        elif slug is not None:
+            race_queryset = race_queryset.filter(
+                **{'game__' + self.game_slug_field: slug})
+        else:
+            raise AttributeError(
+                "{0} must be called with either a game pk or a slug.".format(
+                    self.__class__.__name__))
 
         pk = self.kwargs.get(self.pk_race_kwarg, None)
         slug = self.kwargs.get(self.slug_race_kwarg, None)
@@ -126,11 +221,60 @@ class ParentRaceMixin(ParentGameMixin):
                 "{0} must be called with either a race pk or a slug.".format(
                     self.__class__.__name__))
 
-        try:
-            return race_queryset.get()
-        except models.Race.DoesNotExist:
+        annotations = {
+            'current_raceturn_id': Max(Case(When(
+                raceturns__turn=F('game__latest_turn'),
+                then=F('raceturns__id')))),
+        }
+        user = self.request.user
+        if user.is_authenticated:
+            annotations.update(
+                user_is_ambassador=Max(Case(
+                    When(ambassadors__user=user, then=Value(1)),
+                    default=Value(0), output_field=IntegerField())),
+                active_ambassador_id=Max(Case(When(
+                    ambassadors__user=user, ambassadors__active=True,
+                    then=F('ambassadors__id')))),
+            )
+        return race_queryset.annotate(**annotations)
+
+    def get_race(self):
+        if self._resolved_race is None:
+            try:
+                self._resolved_race = self.get_race_queryset().get()
+            except models.Race.DoesNotExist:
+                raise Http404
+        return self._resolved_race
+
+    def get_game(self):
+        return self.get_race().game
+
+    def check_ambassador(self, active=True):
+        race = self.get_race()
+        if active:
+            allowed = getattr(race, 'active_ambassador_id', None) is not None
+        else:
+            allowed = bool(getattr(race, 'user_is_ambassador', 0))
+        if not allowed:
+            raise PermissionDenied
+
+    def get_ambassador(self):
+        self.check_ambassador()
+        return models.Ambassador.objects.get(
+            pk=self.get_race().active_ambassador_id)
+
+    def get_raceturn(self):
+        race = self.get_race()
+        if race.current_raceturn_id is None:
             raise Http404
 
+        raceturn = models.RaceTurn.objects.select_related(
+            'mfile', 'xfile', 'hfile', 'packet').get(
+                pk=race.current_raceturn_id)
+        raceturn.race = race
+        raceturn.turn = race.game.latest_turn
+        return raceturn
+
     def get_context_data(self, **kwargs):
         context = {self.context_race_name: self.race}
         context.update(kwargs)
@@ -142,9 +286,9 @@ class GameMapDownload(ParentGameMixin, View):
         self.game = self.get_game()
         if self.game.mapfile is None:
             raise Http404
-        return sendfile(
-            self.request, self.game.mapfile.file.path, attachment=True,
-            attachment_filename='{name}.xy'.format(name=self.game.slug[:8]))
+        return send_starsfile(
+            self.request, self.game.mapfile,
+            '{name}.xy'.format(name=self.game.slug[:8]))
 
 
 class GameAdminView(ParentGameMixin, UpdateView):
@@ -272,17 +416,9 @@ class RaceUpdateView(ParentGameMixin, UpdateView):
         racefile = form.instance.racefile
 
         if racefile:
-            sf = base.StarsFile()
-            try:  # FIXME
-                racefile.file.open('rb')
-                data = racefile.file.read()
-                sf.bytes = data
-            finally:
-                racefile.file.close()
-
-            race_struct = sf.structs[1]
-            name = race_struct.race_name
-            plural_name = race_struct.plural_race_name
+            # The names are usually read from the file when it is
+            # stored, so it only needs parsing if they have to change.
+            name, plural_name = racefile.race_names()
             altered = False
 
             if name != form.instance.name or plural_name != form.instance.plural_name:
@@ -294,6 +430,8 @@ class RaceUpdateView(ParentGameMixin, UpdateView):
                 altered = True
 
             if altered:
+                sf = parsing.writable(racefile.parsed())
+                race_struct = sf.structs[1]
                 race_struct.race_name = form.instance.name
                 race_struct.plural_race_name = form.instance.plural_name
 
@@ -317,10 +455,7 @@ class AmbassadorUpdateView(ParentRaceMixin, UpdateView):
                                             active=True)
 
     def get_object(self):
-        try:
-            return self.get_queryset().get()
-        except models.Ambassador.DoesNotExist:
-            raise PermissionDenied
+        return self.get_ambassador()
 
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
@@ -341,6 +476,8 @@ class AmbassadorUpdateView(ParentRaceMixin, UpdateView):
         return super(AmbassadorUpdateView, self).dispatch(*args, **kwargs)
 
 
+@caching.cached_game
+@conditional.conditional_game
 class RacePageView(ParentRaceMixin, DetailView):
     def get_object(self, queryset=None):
         if self.kwargs.get('slug') is None:
@@ -367,9 +504,7 @@ class RacePageCreate(ParentRaceMixin, CreateView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -379,9 +514,7 @@ class RacePageCreate(ParentRaceMixin, CreateView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -411,9 +544,7 @@ class RacePageUpdate(ParentRaceMixin, UpdateView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -423,9 +554,7 @@ class RacePageUpdate(ParentRaceMixin, UpdateView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -456,9 +585,7 @@ class RacePageDelete(ParentRaceMixin, DeleteView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -468,9 +595,7 @@ class RacePageDelete(ParentRaceMixin, DeleteView):
         self.game = self.get_game()
         self.race = self.get_race()
 
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state == 'F':
             raise PermissionDenied
 
@@ -487,13 +612,6 @@ class RacePageDelete(ParentRaceMixin, DeleteView):
 class RaceDashboardView(ParentRaceMixin, TemplateView):
     template_name = 'starsweb/race_dashboard.html'
 
-    def get_ambassador(self):
-        try:
-            return self.race.ambassadors.get(user=self.request.user,
-                                             active=True)
-        except models.Ambassador.DoesNotExist:
-            raise PermissionDenied
-
     def get_context_data(self, **kwargs):
         context = {'game': self.game,
                    'race': self.race,
@@ -506,6 +624,16 @@ class RaceDashboardView(ParentRaceMixin, TemplateView):
         if self.game.state != 'F':
             context.update(
                 ambassador_form=forms.AmbassadorForm(instance=self.ambassador))
+        if self.race.current_raceturn_id is not None:
+            raceturn = self.get_raceturn()
+        else:
+            raceturn = None
+        context.update(
+            download_links=downloads.race_links(self.game, self.race, raceturn),
+            bundle=raceturn is not None)
+        if self.race.racefile is not None:
+            context.update(racefile_url=self.race.racefile.get_download_url(
+                '{0}.r1'.format(self.race.slug)))
         context.update(kwargs)
         return super(RaceDashboardView, self).get_context_data(**context)
 
@@ -520,33 +648,18 @@ class RaceDashboardView(ParentRaceMixin, TemplateView):
         return super(RaceDashboardView, self).dispatch(*args, **kwargs)
 
 
+@caching.cached_game
+@conditional.conditional_game
 class ScoreGraphView(DetailView):
     model = models.Game
     template_name = 'starsweb/score_graph.html'
 
     def get_context_data(self, **kwargs):
-        scores = models.Score.objects.select_related(
-            'turn', 'race'
-        ).filter(
-            turn__game=self.object
-        ).values('section', 'turn__year', 'race__plural_name', 'value')
-
+        # The scores themselves are fetched by the page from ScoreDataView.
         races = list(self.object.races.values_list(
             'plural_name', flat=True).order_by('id'))
 
-        year_min, year_max = 2400, 2400
-        if scores:
-            year_min = min(x['turn__year'] for x in scores)
-            year_max = max(x['turn__year'] for x in scores)
-
-        score_data = {}
-        for item in scores:
-            section_set = score_data.setdefault(
-                models.Score.TOKEN_VALUES[item['section']], {})
-            race_scores = section_set.setdefault(
-                item['race__plural_name'],
-                [None for x in range(year_min, year_max+1)])
-            race_scores[item['turn__year'] - year_min] = item['value']
+        years = self.object.turns.aggregate(Min('year'), Max('year'))
 
         context = {
             'races': json.dumps(races),
@@ -557,14 +670,245 @@ class ScoreGraphView(DetailView):
             'json_sections': json.dumps(dict(models.Score.NAMES)),
             'from_year': self.request.GET.get('from_year', ''),
             'to_year': self.request.GET.get('to_year', ''),
-            'scores': json.dumps(score_data),
-            'year_min': year_min,
-            'year_max': year_max,
+            'year_min': years['year__min'] or 2400,
+            'year_max': years['year__max'] or 2400,
         }
         context.update(kwargs)
         return super(ScoreGraphView, self).get_context_data(**context)
 
 
+class ScoreDataView(ParentGameMixin, View):
+    """A game's scores as JSON, for the score graph.
+
+    Accepts any number of ``section`` tokens and ``races[]`` names, and
+    ``from_year``/``to_year`` bounds.  ``since_year`` asks for only the
+    years after it, so that a client can fetch just the turns generated
+    since it last loaded.
+
+    Each series is a list with one value per year from ``year_min``,
+    unless ``points`` is given; then it is a list of ``[year, value]``
+    pairs, downsampled to at most that many points.
+
+    The scores come from the artefact written when the current turn was
+    generated, if there is one; an unfiltered request is sent that file
+    as it is.  Other responses, such as the graph's downsampled overview
+    of a section, are cached under the game's version.
+
+    """
+
+    def get(self, request, *args, **kwargs):
+        self.game = self.get_game()
+
+        tokens = dict((token, value) for value, token
+                      in six.iteritems(models.Score.TOKEN_VALUES))
+        sections = request.GET.getlist('section')
+        if any(s not in tokens for s in sections):
+            return HttpResponseBadRequest("Unknown score section.")
+
+        try:
+            from_year, to_year, since_year, points = [
+                int(request.GET[param]) if request.GET.get(param) else None
+                for param in ('from_year', 'to_year', 'since_year', 'points')
+            ]
+        except ValueError:
+            return HttpResponseBadRequest("Years and points must be integers.")
+        if points is not None and points < 3:
+            return HttpResponseBadRequest("Ask for at least 3 points.")
+
+        if since_year is not None:
+            from_year = max(from_year or since_year + 1, since_year + 1)
+        races = request.GET.getlist('races[]')
+
+        current = self.game.current_turn
+        current_year = current.year if current else None
+
+        filtered = (sections or races or points is not None or
+                    from_year is not None or to_year is not None)
+        if current is not None and not filtered:
+            response = self.send_artefact(current_year)
+            if response is not None:
+                return response
+
+        def build():
+            artefact = None
+            if current is not None:
+                artefact = caching.get_game_data(
+                    self.game.slug, 'scores',
+                    lambda: scores.read_artefact(self.game, current_year))
+
+            if artefact is not None:
+                year_min, year_max, matrix = scores.slice_matrix(
+                    artefact['year_min'], artefact['scores'],
+                    sections=sections or None, races=races,
+                    from_year=from_year, to_year=to_year)
+            else:
+                year_min, year_max, matrix = scores.score_matrix(
+                    self.game,
+                    sections=[tokens[s] for s in sections] if sections else None,
+                    races=races, from_year=from_year, to_year=to_year)
+            if points is not None:
+                matrix = scores.downsample(matrix, year_min, points)
+
+            return {
+                'year_min': year_min,
+                'year_max': year_max,
+                'current_year': current_year,
+                'scores': matrix,
+            }
+
+        # Keyed on the whole query, so that the graph's overview of each
+        # section is sliced and downsampled once per turn.
+        query = hashlib.md5(json.dumps(
+            sorted(request.GET.lists())).encode('utf-8')).hexdigest()
+        return JsonResponse(caching.get_game_data(
+            self.game.slug, 'scores:{0}'.format(query), build))
+
+    def send_artefact(self, year):
+        storage = scores.artefact_storage()
+        name = scores.artefact_name(self.game, year)
+        if compression.accepts_encoding(self.request, 'gzip'):
+            name += '.gz'
+        if not storage.exists(name):
+            return None
+
+        response = sendfile(self.request, storage.path(name),
+                            attachment_filename=False,
+                            mimetype='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class SignedFileDownload(View):
+    """Serves a file named by a signed link; see ``downloads``.
+
+    No database query is made, so this can be routed to workers without
+    a database connection.
+
+    """
+
+    def get(self, request, *args, **kwargs):
+        found = downloads.read_token(kwargs['token'])
+        if found is None:
+            raise PermissionDenied
+        name, method, filename = found
+        return send_stored(request, downloads.storage().path(name), method,
+                           filename)
+
+
+class StarsFileDownload(View):
+    """A stored file, addressed by the digest of its contents.
+
+    The response for a digest never changes, so it is sent with a strong
+    ETag, Last-Modified and a year-long immutable Cache-Control, and a
+    single byte range is honoured so that an interrupted download can be
+    resumed.  The ETag and ranges are those of the bytes actually sent,
+    which depend on whether the client takes the stored compression.
+
+    Game maps are public; anything else can only be fetched by a user
+    who could download it from one of the other download views.
+
+    """
+    max_age = 365 * 24 * 60 * 60
+
+    def get_starsfile(self, digest):
+        allowed = Q(game__isnull=False)
+        user = self.request.user
+        if user.is_authenticated:
+            allowed |= (Q(race__ambassadors__user=user) |
+                        Q(official_race__ambassadors__user=user) |
+                        Q(mraceturn__race__ambassadors__user=user) |
+                        Q(xraceturn__race__ambassadors__user=user) |
+                        Q(hraceturn__race__ambassadors__user=user) |
+                        Q(userrace__user=user))
+        starsfile = models.StarsFile.objects.filter(
+            allowed, digest=digest).order_by('timestamp').first()
+        if starsfile is None:
+            raise Http404
+        return starsfile
+
+    def get(self, request, *args, **kwargs):
+        starsfile = self.get_starsfile(kwargs['digest'])
+        filename = kwargs['filename']
+
+        path = starsfile.file.path
+        encoding = None
+        data = None
+        if starsfile.compression:
+            if compression.accepts(request, starsfile.compression):
+                encoding = compression.CONTENT_ENCODINGS[starsfile.compression]
+            else:
+                data = starsfile.read()
+        size = os.path.getsize(path) if data is None else len(data)
+
+        etag = '"{0}{1}"'.format(
+            starsfile.digest, '-' + encoding if encoding else '')
+        last_modified = calendar.timegm(starsfile.timestamp.utctimetuple())
+
+        def finish(response):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = '{0}, max-age={1}, immutable'.format(
+                'public' if starsfile.type == 'xy' else 'private',
+                self.max_age)
+            response['Accept-Ranges'] = 'bytes'
+            if encoding:
+                response['Content-Encoding'] = encoding
+            patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return finish(not_modified)
+
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and self.if_range(etag, last_modified):
+            try:
+                byte_range = ranges.parse_range(request.META['HTTP_RANGE'],
+                                                size)
+            except ranges.Unsatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{0}'.format(size)
+                return finish(response)
+
+        if byte_range is None:
+            if data is None:
+                response = sendfile(request, path, attachment=True,
+                                    attachment_filename=filename)
+            else:
+                response = HttpResponse(
+                    data, content_type='application/octet-stream')
+                response['Content-Length'] = str(size)
+            response['Content-Disposition'] = (
+                'attachment; filename="{0}"'.format(filename))
+            return finish(response)
+
+        first, last = byte_range
+        if data is None:
+            with open(path, 'rb') as f:
+                f.seek(first)
+                part = f.read(last - first + 1)
+        else:
+            part = data[first:last + 1]
+        response = HttpResponse(part, status=206,
+                                content_type='application/octet-stream')
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+            first, last, size)
+        response['Content-Length'] = str(len(part))
+        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+            filename)
+        return finish(response)
+
+    def if_range(self, etag, last_modified):
+        # A range is only sent if the client's copy is still this one.
+        validator = self.request.META.get('HTTP_IF_RANGE')
+        if validator is None:
+            return True
+        if validator.startswith('"') or validator.startswith('W/'):
+            return validator == etag
+        return parse_http_date_safe(validator) == last_modified
+
+
 class UserDashboard(TemplateView):
     template_name = 'starsweb/user_dashboard.html'
 
@@ -689,17 +1033,7 @@ class RaceFileBind(ParentGameMixin, UpdateView):
         racefile = form.instance.racefile
 
         if racefile:
-            sf = base.StarsFile()
-            try:  # FIXME
-                racefile.file.open('rb')
-                data = racefile.file.read()
-                sf.bytes = data
-            finally:
-                racefile.file.close()
-
-            race_struct = sf.structs[1]
-            name = race_struct.race_name
-            plural_name = race_struct.plural_race_name
+            name, plural_name = racefile.race_names()
             altered = False
 
             if name != self.object.name or plural_name != self.object.plural_name:
@@ -711,12 +1045,14 @@ class RaceFileBind(ParentGameMixin, UpdateView):
                 altered = True
 
             if altered:
+                sf = parsing.writable(racefile.parsed())
+                race_struct = sf.structs[1]
                 race_struct.race_name = self.object.name
                 race_struct.plural_race_name = self.object.plural_name
 
                 content = sf.bytes
             else:
-                content = data
+                content = racefile.read()
 
             new_starsfile = models.StarsFile(
                 upload_user=racefile.upload_user,
@@ -758,11 +1094,9 @@ class UserRaceDownload(UserRaceMixin, View):
             raise PermissionDenied
         if self.userrace.racefile is None:
             raise Http404
-        return sendfile(
-            self.request, self.userrace.racefile.file.path, attachment=True,
-            attachment_filename='{name}.r1'.format(
-                name=slugify(self.userrace.identifier)[:8])
-        )
+        return send_starsfile(
+            self.request, self.userrace.racefile,
+            '{name}.r1'.format(name=slugify(self.userrace.identifier)[:8]))
 
 
 class UserRaceUpload(UserRaceMixin, CreateView):
@@ -824,10 +1158,12 @@ class UserRaceUpload(UserRaceMixin, CreateView):
                 " 'The' before it. The file has been edited to fix this.")
 
         if altered:
+            sf = parsing.writable(form.stars_file)
+            race_struct = sf.structs[1]
             race_struct.race_name = name
             race_struct.plural_race_name = plural_name
 
-            content = ContentFile(form.stars_file.bytes)
+            content = ContentFile(sf.bytes)
             form.instance.file.file = content
 
         messages.success(
@@ -845,8 +1181,7 @@ class RaceFileDownload(ParentRaceMixin, View):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user).exists():
-            raise PermissionDenied
+        self.check_ambassador(active=False)
 
         if self.race.official_racefile is not None:
             racefile = self.race.official_racefile
@@ -855,9 +1190,8 @@ class RaceFileDownload(ParentRaceMixin, View):
         else:
             raise Http404
 
-        return sendfile(
-            self.request, self.race.racefile.file.path, attachment=True,
-            attachment_filename='{name}.r1'.format(name=self.race.slug))
+        return send_starsfile(
+            self.request, racefile, '{name}.r1'.format(name=self.race.slug))
 
 
 class RaceFileUpload(ParentRaceMixin, CreateView):
@@ -888,10 +1222,12 @@ class RaceFileUpload(ParentRaceMixin, CreateView):
             altered = True
 
         if altered:
+            sf = parsing.writable(form.stars_file)
+            race_struct = sf.structs[1]
             race_struct.race_name = self.race.name
             race_struct.plural_race_name = self.race.plural_name
 
-            content = ContentFile(form.stars_file.bytes)
+            content = ContentFile(sf.bytes)
             form.instance.file.file = content
 
         response = super(RaceFileUpload, self).form_valid(form)
@@ -906,9 +1242,7 @@ class RaceFileUpload(ParentRaceMixin, CreateView):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state != 'S':
             raise PermissionDenied
         return super(RaceFileUpload, self).get(request, *args, **kwargs)
@@ -916,9 +1250,7 @@ class RaceFileUpload(ParentRaceMixin, CreateView):
     def post(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state != 'S':
             raise PermissionDenied
         return super(RaceFileUpload, self).post(request, *args, **kwargs)
@@ -932,22 +1264,14 @@ class StateFileDownload(ParentRaceMixin, View):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user).exists():
-            raise PermissionDenied
+        self.check_ambassador(active=False)
 
-        current = self.game.current_turn
-        if current is None:
-            raise Http404
-
-        raceturn = current.raceturns.filter(race=self.race, mfile__isnull=False)
-        if not raceturn:
+        raceturn = self.get_raceturn()
+        if raceturn.mfile is None:
             raise Http404
 
-        raceturn = raceturn.get()
-
-        return sendfile(
-            self.request, raceturn.mfile.file.path, attachment=True,
-            attachment_filename='{name}.m{num}'.format(
+        return send_starsfile(
+            self.request, raceturn.mfile, '{name}.m{num}'.format(
                 name=self.game.slug[:8], num=self.race.player_number + 1))
 
 
@@ -959,22 +1283,14 @@ class OrderFileDownload(ParentRaceMixin, View):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user).exists():
-            raise PermissionDenied
+        self.check_ambassador(active=False)
 
-        current = self.game.current_turn
-        if current is None:
+        raceturn = self.get_raceturn()
+        if raceturn.xfile is None:
             raise Http404
 
-        raceturn = current.raceturns.filter(race=self.race, xfile__isnull=False)
-        if not raceturn:
-            raise Http404
-
-        raceturn = raceturn.get()
-
-        return sendfile(
-            self.request, raceturn.xfile.file.path, attachment=True,
-            attachment_filename='{name}.x{num}'.format(
+        return send_starsfile(
+            self.request, raceturn.xfile, '{name}.x{num}'.format(
                 name=self.game.slug[:8], num=self.race.player_number + 1))
 
 
@@ -1005,40 +1321,24 @@ class OrderFileUpload(ParentRaceMixin, CreateView):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state not in ('A', 'P'):
             raise PermissionDenied
 
         self.current_turn = self.game.current_turn
-        if self.current_turn is None:
-            raise Http404
-
-        raceturn = self.current_turn.raceturns.filter(race=self.race)
-        if not raceturn:
-            raise Http404
-        self.raceturn = raceturn.get()
+        self.raceturn = self.get_raceturn()
 
         return super(OrderFileUpload, self).get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state not in ('A', 'P'):
             raise PermissionDenied
 
         self.current_turn = self.game.current_turn
-        if self.current_turn is None:
-            raise Http404
-
-        raceturn = self.current_turn.raceturns.filter(race=self.race)
-        if not raceturn:
-            raise Http404
-        self.raceturn = raceturn.get()
+        self.raceturn = self.get_raceturn()
 
         return super(OrderFileUpload, self).post(request, *args, **kwargs)
 
@@ -1051,23 +1351,73 @@ class HistoryFileDownload(ParentRaceMixin, View):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user).exists():
-            raise PermissionDenied
+        self.check_ambassador(active=False)
 
-        current = self.game.current_turn
-        if current is None:
+        raceturn = self.get_raceturn()
+        if raceturn.hfile is None:
             raise Http404
 
-        raceturn = current.raceturns.filter(race=self.race, hfile__isnull=False)
-        if not raceturn:
-            raise Http404
+        return send_starsfile(
+            self.request, raceturn.hfile, '{name}.h{num}'.format(
+                name=self.game.slug[:8], num=self.race.player_number + 1))
 
-        raceturn = raceturn.get()
 
-        return sendfile(
-            self.request, raceturn.hfile.file.path, attachment=True,
-            attachment_filename='{name}.h{num}'.format(
-                name=self.game.slug[:8], num=self.race.player_number + 1))
+class TurnBundleDownload(ParentRaceMixin, View):
+    """The race's current turn files and the game's map, as one zip.
+
+    The packet built at generation is sent if it is still complete;
+    otherwise the archive is written as it is sent, from the stored
+    files a chunk at a time.
+
+    """
+
+    @method_decorator(login_required)
+    def dispatch(self, *args, **kwargs):
+        return super(TurnBundleDownload, self).dispatch(*args, **kwargs)
+
+    def get_members(self, raceturn):
+        prefix = self.game.slug[:8]
+        number = self.race.player_number + 1
+
+        files = [(raceturn.mfile, '{0}.m{1}'.format(prefix, number))]
+        if self.game.mapfile is not None:
+            files.append((self.game.mapfile, '{0}.xy'.format(prefix)))
+        if raceturn.hfile is not None:
+            files.append((raceturn.hfile, '{0}.h{1}'.format(prefix, number)))
+        if raceturn.xfile is not None:
+            files.append((raceturn.xfile, '{0}.x{1}'.format(prefix, number)))
+
+        members = []
+        for starsfile, filename in files:
+            timestamp = starsfile.timestamp
+            if timezone.is_aware(timestamp):
+                timestamp = timezone.localtime(timestamp)
+            members.append(
+                (filename, starsfile.chunks(), timestamp.timetuple()))
+        return members
+
+    def get(self, request, *args, **kwargs):
+        self.game = self.get_game()
+        self.race = self.get_race()
+        self.check_ambassador(active=False)
+
+        raceturn = self.get_raceturn()
+        filename = '{0}-{1}-{2}.zip'.format(
+            self.game.slug[:8], raceturn.turn.year, self.race.player_number + 1)
+
+        # The packet built at generation holds only the m file and the
+        # map, so it will do until an h or x file has been uploaded.
+        if (raceturn.packet is not None and raceturn.hfile is None and
+                raceturn.xfile is None):
+            return send_starsfile(request, raceturn.packet, filename,
+                                  mimetype='application/zip')
+
+        response = StreamingHttpResponse(
+            zipstream.zip_stream(self.get_members(raceturn)),
+            content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+            filename)
+        return response
 
 
 class HistoryFileUpload(ParentRaceMixin, CreateView):
@@ -1097,39 +1447,23 @@ class HistoryFileUpload(ParentRaceMixin, CreateView):
     def get(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state not in ('A', 'P'):
             raise PermissionDenied
 
         self.current_turn = self.game.current_turn
-        if self.current_turn is None:
-            return Http404
-
-        raceturn = self.current_turn.raceturns.filter(race=self.race)
-        if not raceturn:
-            raise Http404
-        self.raceturn = raceturn.get()
+        self.raceturn = self.get_raceturn()
 
         return super(HistoryFileUpload, self).get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
         self.game = self.get_game()
         self.race = self.get_race()
-        if not self.race.ambassadors.filter(user=self.request.user,
-                                            active=True).exists():
-            raise PermissionDenied
+        self.check_ambassador()
         if self.game.state not in ('A', 'P'):
             raise PermissionDenied
 
         self.current_turn = self.game.current_turn
-        if self.current_turn is None:
-            return Http404
-
-        raceturn = self.current_turn.raceturns.filter(race=self.race)
-        if not raceturn:
-            raise Http404
-        self.raceturn = raceturn.get()
+        self.raceturn = self.get_raceturn()
 
         return super(HistoryFileUpload, self).post(request, *args, **kwargs)
@@ -0,0 +1,118 @@
+"""A zip archive written as a stream of byte strings.
+
+Each member's CRC and sizes follow its data in a data descriptor, so a
+member's contents can be passed through chunk by chunk as they are read,
+and the archive never has to be held in memory or written to disk.
+Members are stored uncompressed unless asked otherwise; most Stars!
+files are encrypted and do not compress.  There is no zip64 support, so
+members and the archive must stay under 4GiB.
+
+"""
+from __future__ import absolute_import
+import struct
+import time
+import zlib
+
+from zipfile import ZIP_DEFLATED, ZIP_STORED
+
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+
+VERSION = 20
+SYSTEM_UNIX = 3
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def dos_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    # DOS dates run from 1980 to 2107.
+    year = min(max(year, 1980), 2107)
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+
+class ZipStream(object):
+    """Write members with ``add`` and finish with ``close``.
+
+    Both are generators of the archive's bytes, which must be consumed
+    in order.
+
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.offset = 0
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def add(self, name, chunks, date_time=None, compress_type=ZIP_STORED):
+        if date_time is None:
+            date_time = time.localtime(time.time())
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        flags = FLAG_DATA_DESCRIPTOR
+        try:
+            name.decode('ascii')
+        except UnicodeDecodeError:
+            flags |= FLAG_UTF8
+        mtime, mdate = dos_time(date_time)
+
+        header_offset = self.offset
+        yield self._emit(LOCAL_HEADER.pack(
+            b'PK\x03\x04', VERSION, 0, flags, compress_type, mtime, mdate,
+            0, 0, 0, len(name), 0) + name)
+
+        crc, size, compressed_size = 0, 0, 0
+        if compress_type == ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                          zlib.DEFLATED, -15)
+        else:
+            compressor = None
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                compressed_size += len(chunk)
+                yield self._emit(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            yield self._emit(chunk)
+        crc &= 0xffffffff
+
+        yield self._emit(DATA_DESCRIPTOR.pack(
+            b'PK\x07\x08', crc, compressed_size, size))
+        self.entries.append((name, flags, compress_type, mtime, mdate, crc,
+                             compressed_size, size, header_offset))
+
+    def close(self):
+        directory_offset = self.offset
+        for (name, flags, compress_type, mtime, mdate, crc, compressed_size,
+             size, header_offset) in self.entries:
+            yield self._emit(CENTRAL_HEADER.pack(
+                b'PK\x01\x02', VERSION, SYSTEM_UNIX, VERSION, 0, flags,
+                compress_type, mtime, mdate, crc, compressed_size, size,
+                len(name), 0, 0, 0, 0, 0o600 << 16, header_offset) + name)
+
+        count = len(self.entries)
+        yield self._emit(END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, count, count,
+            self.offset - directory_offset, directory_offset, 0))
+
+
+def zip_stream(members, compress_type=ZIP_STORED):
+    """Yield a zip archive of ``(name, chunks, date_time)`` members."""
+    archive = ZipStream()
+    for name, chunks, date_time in members:
+        for data in archive.add(name, chunks, date_time, compress_type):
+            yield data
+    for data in archive.close():
+        yield data